@@ -0,0 +1,389 @@
+"""
+Similarity search over the binary record x attribute matrix built by json_vectorizer
+
+explore_vectorize_json finds records like a test row with distance.cdist against the dense matrix, which
+reads every cell of every record for each query.  AttributeIndex keeps the matrix sparse and offers
+* exact search - the query's attributes are looked up in an inverted index (the transposed CSR matrix,
+  one posting list of records per attribute) so only records sharing an attribute are scored
+* MinHash LSH search - records are bucketed by banded MinHash signatures, and only records sharing a
+  bucket with the query are scored.  Queries without enough candidates fall back to exact search
+Both score candidates by exact jaccard or cosine similarity from the intersection sizes, take queries in
+batches, and return the top k records per query.
+
+The index is saved as .npy arrays in a folder and loaded memory mapped, so opening it is immediate and
+pages are read on demand.  Shared attribute counts come from the matrix structure alone, the index never
+holds an array of its all ones values.
+"""
+
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+
+from json_vectorizer import vectorize_records
+
+_EMPTY = np.iinfo(np.uint32).max
+
+""" MINHASH FUNCTIONS """
+
+
+def _hash_columns(columns, hash_a, hash_b):
+    # (permutations x columns) uint32 multiply-add-shift hashes of 32 bit column ids, uint64 arithmetic wraps
+    columns = np.asarray(columns, dtype=np.uint64)
+    return ((hash_a[:, None] * columns + hash_b[:, None]) >> np.uint64(32)).astype(np.uint32)
+
+
+def minhash_signatures(matrix, hash_a, hash_b, chunk_elements=1 << 23):
+    """
+    :param matrix: binary CSR matrix, rows are records
+    :param hash_a: odd uint64 array of hash multipliers, one per permutation
+    :param hash_b: uint64 array of hash offsets
+    :param chunk_elements: rows are hashed in chunks of about this many non zeros x permutations
+
+    :return:
+        (rows x permutations) uint32 array of minimum hashed column per row.  Empty rows are all max uint32
+    """
+    n_rows, n_perm = matrix.shape[0], len(hash_a)
+    signatures = np.full((n_rows, n_perm), _EMPTY, dtype=np.uint32)
+    indptr = np.asarray(matrix.indptr)
+
+    # with a vocabulary of attributes rather than hashed columns, every column's hashes fit in a small
+    # table and hashing a chunk becomes a lookup
+    table = _hash_columns(np.arange(matrix.shape[1]), hash_a, hash_b) \
+        if matrix.shape[1] * n_perm <= chunk_elements else None
+
+    row_start = 0
+    while row_start < n_rows:
+        # enough rows for about chunk_elements hashes, at least one row
+        row_end = int(np.searchsorted(indptr, indptr[row_start] + max(chunk_elements // max(n_perm, 1), 1),
+                                      side='right')) - 1
+        row_end = min(max(row_end, row_start + 1), n_rows)
+
+        starts = indptr[row_start:row_end + 1] - indptr[row_start]
+        non_empty = np.flatnonzero(np.diff(starts))
+        if len(non_empty):
+            columns = matrix.indices[indptr[row_start]:indptr[row_end]]
+            # permutations x non zeros, so each row minimum is a reduction over contiguous memory
+            hashed = table.take(columns, axis=1) if table is not None else _hash_columns(columns, hash_a, hash_b)
+            signatures[row_start + non_empty] = np.minimum.reduceat(hashed, starts[non_empty], axis=1).T
+
+        row_start = row_end
+
+    return signatures
+
+
+def band_keys(signatures, multipliers):
+    """
+    :param signatures: (rows x permutations) signatures - see minhash_signatures
+    :param multipliers: (bands x rows per band) uint64 array of odd multipliers
+
+    :return:
+        (bands x rows) uint64 array of each record's bucket key in each band
+    """
+    n_bands, band_size = multipliers.shape
+    keys = np.zeros((n_bands, len(signatures)), dtype=np.uint64)
+
+    # multiply-add with uint64 wrap around, collisions only add candidates that are then scored exactly.
+    # permutation j of every band at once, band b's being column b * band_size + j
+    for j in range(band_size):
+        keys += signatures[:, j::band_size].T.astype(np.uint64) * multipliers[:, j:j + 1]
+
+    return keys
+
+
+""" SCORE FUNCTIONS """
+
+
+def _binary(matrix, n_columns=None):
+    # boolean CSR copy with duplicates merged, only its indices and indptr are used for scoring
+    matrix = sparse.csr_matrix(matrix, dtype=np.bool_, copy=True)
+    matrix.sum_duplicates()
+    matrix.data[:] = True
+    if n_columns is not None and matrix.shape[1] != n_columns:
+        raise ValueError(f"Queries have {matrix.shape[1]} attributes, the index has {n_columns}")
+
+    return matrix
+
+
+def _gather(indptr, indices, rows):
+    # concatenated indices of some rows of a CSR structure, and the number taken from each row
+    starts = np.asarray(indptr[rows])
+    lengths = np.asarray(indptr[rows + 1]) - starts
+    offsets = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+    return indices[offsets], lengths
+
+
+def _scores(intersections, query_size, row_sizes, metric):
+    if metric == 'jaccard':
+        return intersections / (query_size + row_sizes - intersections)
+    if metric == 'cosine':
+        return intersections / np.sqrt(query_size * row_sizes)
+
+    raise ValueError(f"Unknown metric {metric}, use jaccard or cosine")
+
+
+def _top_k(candidates, scores, k):
+    # best k by score, ties broken by lowest row.  everything tied with the kth score is kept for the sort
+    if len(candidates) > k:
+        keep = scores >= np.partition(scores, len(scores) - k)[len(scores) - k]
+        candidates, scores = candidates[keep], scores[keep]
+    order = np.lexsort((candidates, -scores))[:k]
+
+    return candidates[order], scores[order]
+
+
+""" INDEX """
+
+
+class AttributeIndex:
+    """
+    Exact and MinHash LSH top k similarity search over a binary record x attribute matrix
+
+    :param matrix: CSR matrix, rows are records, i.e. from json_vectorizer.vectorize_jsonl
+    :param num_perm: number of MinHash permutations, 0 for an exact search only index
+    :param bands: number of LSH bands, must divide num_perm.  more bands find less similar records
+    :param seed: seed for the MinHash permutations
+    """
+
+    def __init__(self, matrix, num_perm=128, bands=32, seed=0, _arrays=None):
+        if _arrays is not None:
+            # loaded by AttributeIndex.load
+            self.__dict__.update(_arrays)
+            return
+
+        if num_perm % max(bands, 1):
+            raise ValueError(f"bands ({bands}) must divide num_perm ({num_perm})")
+
+        self.matrix = _binary(matrix)
+        self.postings = self.matrix.T.tocsr()
+        self.row_sizes = np.diff(self.matrix.indptr).astype(np.float32)
+
+        rng = np.random.default_rng(seed)
+        self.hash_a = rng.integers(0, 1 << 64, num_perm, dtype=np.uint64) | np.uint64(1)
+        self.hash_b = rng.integers(0, 1 << 64, num_perm, dtype=np.uint64)
+        self.multipliers = rng.integers(0, 1 << 64, (bands, num_perm // max(bands, 1)), dtype=np.uint64) | np.uint64(1)
+
+        if num_perm:
+            # signatures are banded a chunk of rows at a time, so they are never all held in memory
+            n_rows = self.matrix.shape[0]
+            keys = np.empty((bands, n_rows), dtype=np.uint64)
+            for start in range(0, n_rows, 100000):
+                keys[:, start:start + 100000] = band_keys(
+                    minhash_signatures(self.matrix[start:start + 100000], self.hash_a, self.hash_b), self.multipliers)
+
+            self.band_rows = np.argsort(keys, axis=1, kind='stable').astype(np.int32)
+            self.band_keys = np.take_along_axis(keys, self.band_rows, axis=1)
+        else:
+            self.band_rows = np.empty((0, self.matrix.shape[0]), dtype=np.int32)
+            self.band_keys = np.empty((0, self.matrix.shape[0]), dtype=np.uint64)
+
+    """ PERSISTENCE """
+
+    _ARRAYS = ['indptr', 'indices', 'postings_indptr', 'postings_indices', 'row_sizes', 'hash_a', 'hash_b',
+               'multipliers', 'band_rows', 'band_keys']
+
+    def save(self, folder):
+        """
+        Save the index as .npy arrays in folder, to be loaded memory mapped
+        """
+        os.makedirs(folder, exist_ok=True)
+
+        arrays = {'indptr': self.matrix.indptr, 'indices': self.matrix.indices,
+                  'postings_indptr': self.postings.indptr, 'postings_indices': self.postings.indices}
+        for name in self._ARRAYS:
+            np.save(os.path.join(folder, f"{name}.npy"), arrays[name] if name in arrays else getattr(self, name))
+
+        with open(os.path.join(folder, 'index.json'), 'w') as fout:
+            json.dump({'shape': self.matrix.shape}, fout)
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        """
+        :param folder: folder written by save
+        :param mmap: memory map the arrays rather than reading them into memory
+
+        :return:
+            AttributeIndex
+        """
+        with open(os.path.join(folder, 'index.json')) as fin:
+            n_rows, n_columns = json.load(fin)['shape']
+
+        arrays = {name: np.load(os.path.join(folder, f"{name}.npy"), mmap_mode='r' if mmap else None)
+                  for name in cls._ARRAYS}
+
+        # csr_matrix keeps the memory mapped index arrays.  the all ones data is a zero strided view of a
+        # single True, so nothing is allocated per non zero
+        matrix = sparse.csr_matrix((np.broadcast_to(np.True_, len(arrays['indices'])), arrays.pop('indices'),
+                                    arrays.pop('indptr')), shape=(n_rows, n_columns), copy=False)
+        postings = sparse.csr_matrix((np.broadcast_to(np.True_, len(arrays['postings_indices'])),
+                                      arrays.pop('postings_indices'), arrays.pop('postings_indptr')),
+                                     shape=(n_columns, n_rows), copy=False)
+
+        return cls(None, _arrays=dict(arrays, matrix=matrix, postings=postings))
+
+    """ SEARCH """
+
+    def exact_candidates(self, queries):
+        """
+        :param queries: binary CSR matrix of query records
+
+        :return:
+            list of (records, float32 shared attribute counts) array pairs per query, only for records
+            sharing an attribute
+        """
+        found = []
+        for i in range(queries.shape[0]):
+            # records are counted across the posting lists of the query's attributes
+            records, _ = _gather(self.postings.indptr, self.postings.indices,
+                                 queries.indices[queries.indptr[i]:queries.indptr[i + 1]])
+            records, counts = np.unique(records, return_counts=True)
+            found.append((records, counts.astype(np.float32)))
+
+        return found
+
+    def lsh_candidates(self, queries, max_bucket=1000):
+        """
+        :param queries: binary CSR matrix of query records
+        :param max_bucket: most records taken from any one bucket
+
+        :return:
+            list of int32 arrays of candidate records per query
+        """
+        keys = band_keys(minhash_signatures(queries, self.hash_a, self.hash_b), self.multipliers)
+        found = [[] for _ in range(queries.shape[0])]
+
+        for band in range(len(keys)):
+            band_keys_sorted = self.band_keys[band]
+            starts = np.searchsorted(band_keys_sorted, keys[band], side='left')
+            ends = np.minimum(np.searchsorted(band_keys_sorted, keys[band], side='right'), starts + max_bucket)
+
+            band_rows = self.band_rows[band]
+            for i in np.flatnonzero(ends > starts).tolist():
+                found[i].append(band_rows[starts[i]:ends[i]])
+
+        return [np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int32) for rows in found]
+
+    def search(self, queries, k=5, metric='jaccard', method='exact', batch_size=256, max_bucket=1000,
+               fallback=True):
+        """
+        Top k most similar records for each query
+
+        :param queries: CSR matrix of query records with the index's columns, i.e. from
+            json_vectorizer.vectorize_records with the index's vocabulary
+        :param k: number of records to return per query
+        :param metric: 'jaccard' or 'cosine' similarity (1 - the notebook's cosine distance)
+        :param method: 'exact' or 'lsh'
+        :param batch_size: queries scored at a time
+        :param max_bucket: most records taken from any one LSH bucket
+        :param fallback: use exact search for queries with fewer than k LSH candidates
+
+        :return:
+            (queries x k) int64 array of record rows, -1 where there are fewer than k matches, and
+            (queries x k) float32 array of their similarities
+        """
+        if method not in ('exact', 'lsh'):
+            raise ValueError(f"Unknown method {method}, use exact or lsh")
+        if method == 'lsh' and not len(self.band_keys):
+            raise ValueError("Index was built with num_perm=0, use method='exact'")
+
+        queries = _binary(queries, self.matrix.shape[1])
+        query_sizes = np.diff(queries.indptr).astype(np.float32)
+
+        rows = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        similarities = np.zeros((queries.shape[0], k), dtype=np.float32)
+
+        for batch_start in range(0, queries.shape[0], batch_size):
+            batch = queries[batch_start:batch_start + batch_size]
+            if method == 'lsh':
+                # queries without enough candidates are left for exact search
+                todo = []
+                for i, candidates in enumerate(self.lsh_candidates(batch, max_bucket)):
+                    if len(candidates) < k and fallback:
+                        todo.append(i)
+                        continue
+                    # attributes of each candidate that are also the query's
+                    columns, lengths = _gather(self.matrix.indptr, self.matrix.indices, candidates)
+                    shared = np.isin(columns, batch.indices[batch.indptr[i]:batch.indptr[i + 1]])
+                    intersections = np.bincount(np.repeat(np.arange(len(candidates)), lengths), weights=shared,
+                                                minlength=len(candidates)).astype(np.float32)
+                    self._fill(rows, similarities, batch_start + i, candidates, intersections, query_sizes, metric)
+            else:
+                todo = list(range(batch.shape[0]))
+
+            if todo:
+                for i, (candidates, intersections) in zip(todo, self.exact_candidates(batch[todo])):
+                    self._fill(rows, similarities, batch_start + i, candidates, intersections, query_sizes, metric)
+
+        return rows, similarities
+
+    def _fill(self, rows, similarities, query, candidates, intersections, query_sizes, metric):
+        shared = intersections > 0
+        candidates, intersections = candidates[shared], intersections[shared]
+        if not len(candidates):
+            return
+
+        scores = _scores(intersections, query_sizes[query], self.row_sizes[candidates], metric)
+        top_rows, top_scores = _top_k(candidates, scores, rows.shape[1])
+        rows[query, :len(top_rows)] = top_rows
+        similarities[query, :len(top_rows)] = top_scores
+
+    def search_rows(self, record_rows, k=5, **kwargs):
+        """
+        Top k most similar records for records already in the index, i.e. the notebook's test_index.
+        Each record finds itself first.  See search for the other parameters
+        """
+        record_rows = np.atleast_1d(record_rows)
+        # built from the index structure, as indexing self.matrix would copy its whole data array
+        columns, lengths = _gather(self.matrix.indptr, self.matrix.indices, record_rows)
+        queries = sparse.csr_matrix((np.ones(len(columns), dtype=np.bool_), columns,
+                                     np.concatenate(([0], np.cumsum(lengths)))),
+                                    shape=(len(record_rows), self.matrix.shape[1]))
+
+        return self.search(queries, k, **kwargs)
+
+
+def search_records(index, records, vocabulary, k=5, **kwargs):
+    """
+    Top k most similar indexed records for new records, i.e. the notebook's input_json
+
+    :param index: AttributeIndex
+    :param records: list of dicts
+    :param vocabulary: the index's attribute tokens - see json_vectorizer.load_vocabulary
+
+    :return:
+        rows and similarities - see AttributeIndex.search
+    """
+    queries, _ = vectorize_records(records, vocabulary=vocabulary)
+
+    return index.search(queries, k, **kwargs)
+
+
+def main():
+    start_time = datetime.now()
+
+    matrix_file = input("Matrix file (from json_vectorizer): ")
+    index_folder = input("Index folder: ")
+
+    if os.path.exists(os.path.join(index_folder, 'index.json')):
+        index = AttributeIndex.load(index_folder)
+    else:
+        index = AttributeIndex(sparse.load_npz(matrix_file))
+        index.save(index_folder)
+    print(f"Index ready: {((datetime.now() - start_time).total_seconds())} seconds")
+
+    while True:
+        row = input("Record row to find similar records for (leave blank to quit): ")
+        if not row:
+            break
+
+        rows, similarities = index.search_rows(int(row), k=5)
+        for match, similarity in zip(rows[0].tolist(), similarities[0].tolist()):
+            if match >= 0:
+                print(f"{match}: {similarity:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Author time of day histograms computed from the pushshift sqlite database
+
+user_frequency asks the Pushshift API for every author's posting times, two requests per author.
+The database built by pushift_files_to_sqlite already holds created_utc for every submission and
+comment, so this module counts posts per author x utc hour of day (optionally x day of week) for all
+authors in one streaming pass over those tables.
+
+Counts are merged as sorted (key, count) arrays rather than a dense authors x hours array, so
+memory scales with the number of non zero cells, and returned as a scipy.sparse CSR matrix with one
+row per user_id.  save_histograms writes the matrix as JSON lines in the same layout as
+user_frequency.save_freq.
+"""
+
+import codecs
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from create_sqlite_db import get_db_connection
+
+DAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+""" HISTOGRAM FUNCTIONS """
+
+
+def _merge_counts(keys, counts):
+    """
+    Sum counts of equal keys
+
+    :return:
+        sorted unique keys and their summed counts
+    """
+    order = np.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+def time_bins(created_utc, day_of_week=False):
+    """
+    :param created_utc: int64 array of utc epoch seconds
+    :param day_of_week: set to True for day of week x hour bins
+
+    :return:
+        int64 array of hour of day (0 - 23), or day of week * 24 + hour (0 - 167, monday is 0)
+    """
+    bins = created_utc // 3600 % 24
+
+    if day_of_week:
+        # 1970-01-01 was a thursday
+        bins += (created_utc // 86400 + 3) % 7 * 24
+
+    return bins
+
+
+def author_time_matrix(cursor, tables=('submissions', 'comments'), after=None, before=None, day_of_week=False,
+                       fetch_size=1000000):
+    """
+    Count posts per author x time of day in one streaming pass over the given tables
+
+    :param cursor: sqlite cursor object
+    :param tables: tables to count posts from
+    :param after: earliest utc epoch seconds to include
+    :param before: exclusive utc epoch seconds to stop at
+    :param day_of_week: set to True for 168 day of week x hour columns rather than 24 hour columns
+    :param fetch_size: rows fetched from sqlite at a time
+
+    :return:
+        scipy.sparse.csr_matrix of int64 counts, row is user_id
+    """
+    n_bins = 168 if day_of_week else 24
+    keys, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    pending, pending_size = [], 0
+    max_author_id = -1
+
+    for table in tables:
+        start = perf_counter()
+        cursor.execute(f"""
+            SELECT author_id, created_utc FROM {table}
+            WHERE author_id IS NOT NULL AND created_utc >= ? AND created_utc < ?
+        """, (after or 0, before or 2 ** 62))
+
+        rows_read = 0
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+
+            values = np.array(rows, dtype=np.int64)
+            max_author_id = max(max_author_id, int(values[:, 0].max()))
+            chunk_keys, chunk_counts = np.unique(values[:, 0] * n_bins + time_bins(values[:, 1], day_of_week),
+                                                 return_counts=True)
+            pending.append((chunk_keys, chunk_counts))
+            pending_size += len(chunk_keys)
+            rows_read += len(rows)
+
+            # merging only once the pending chunks outgrow the totals keeps merging cost linear overall
+            if pending_size >= len(keys):
+                keys, counts = _merge_counts(np.concatenate([keys] + [k for k, _ in pending]),
+                                             np.concatenate([counts] + [c for _, c in pending]))
+                pending, pending_size = [], 0
+
+        print(f"{table}: {rows_read} posts counted in {perf_counter() - start:.1f} seconds")
+
+    if pending:
+        keys, counts = _merge_counts(np.concatenate([keys] + [k for k, _ in pending]),
+                                     np.concatenate([counts] + [c for _, c in pending]))
+
+    return sparse.csr_matrix((counts, (keys // n_bins, keys % n_bins)), shape=(max_author_id + 1, n_bins))
+
+
+def column_names(n_bins):
+    """
+    Hour columns 0 - 23 as written by user_frequency, or 'mon_0' - 'sun_23' for day of week bins
+    """
+    if n_bins == 24:
+        return list(range(24))
+
+    return [f"{day}_{hour}" for day in DAY_NAMES for hour in range(24)]
+
+
+def author_names(cursor, author_ids, chunk_size=900):
+    """
+    :param cursor: sqlite cursor object
+    :param author_ids: list of user_ids
+
+    :return:
+        dict of user_id to author
+    """
+    names = {}
+
+    for i in range(0, len(author_ids), chunk_size):
+        chunk = author_ids[i:i + chunk_size]
+        cursor.execute(f"SELECT user_id, author FROM users WHERE user_id IN ({','.join('?' * len(chunk))})", chunk)
+        names.update(cursor.fetchall())
+
+    return names
+
+
+def matrix_to_df(cursor, matrix, min_posts=1, first_id=0):
+    """
+    Pivoted author x time of day dataframe in the user_frequency.save_freq layout
+
+    :param cursor: sqlite cursor object
+    :param matrix: csr matrix from author_time_matrix, or a slice of its rows
+    :param min_posts: authors with fewer posts are left out
+    :param first_id: user_id of the first row, for a slice of rows
+
+    :return:
+        dataframe with an author column and one column per time bin
+    """
+    totals = np.asarray(matrix.sum(axis=1)).ravel()
+    rows = np.flatnonzero(totals >= max(min_posts, 1))
+    author_ids = (rows + first_id).tolist()
+
+    names = author_names(cursor, author_ids)
+    df = pd.DataFrame(matrix[rows].toarray(), columns=column_names(matrix.shape[1]))
+    df.insert(0, 'author', [names.get(author_id) for author_id in author_ids])
+
+    return df
+
+
+def save_histograms(cursor, matrix, freq_file, min_posts=1, chunk_size=100000):
+    """
+    Append the matrix to a JSON lines file, chunk_size authors at a time so it is never fully densified
+
+    :param cursor: sqlite cursor object
+    :param matrix: csr matrix from author_time_matrix
+    :param freq_file: JSON lines file to append to
+    :param min_posts: authors with fewer posts are left out
+    :param chunk_size: rows converted to a dataframe at a time
+
+    :return:
+        number of authors written
+    """
+    written = 0
+
+    with codecs.open(freq_file, 'a', encoding='utf-8') as fout:
+        for start in range(0, matrix.shape[0], chunk_size):
+            df = matrix_to_df(cursor, matrix[start:start + chunk_size], min_posts, first_id=start)
+            if df.empty:
+                continue
+
+            df.to_json(fout, orient='records', lines=True)
+            fout.write('\n')
+            written += len(df)
+
+    return written
+
+
+def main():
+    print("Enter filepath for sqlite db file to count from: (i.e. F:/Data/my_db.db)")
+    db_file = input("DB File: ")
+    freq_file = input("Output JSON lines file: ")
+    day_of_week = input("Split by day of week? (y/n): ").lower().startswith('y')
+
+    conn, cursor = get_db_connection(db_file)
+
+    matrix = author_time_matrix(cursor, day_of_week=day_of_week)
+    sparse.save_npz(freq_file.rsplit('.', 1)[0] + '.npz', matrix)
+
+    written = save_histograms(cursor, matrix, freq_file)
+    print(f"{written} authors saved to {freq_file}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,14 +3,49 @@ import codecs
 import pathlib
 import pandas as pd
 from collections import deque
+from contextlib import nullcontext
 import dateutil
 from datetime import datetime, timedelta
-import numpy as np
+from itertools import islice
 
 # external imports
 from psaw import PushshiftAPI
 import praw
 
+from pushshift_fetcher import fetch_concurrent
+
+
+# Columns wanted for smaller dataset
+COLUMNS_TO_KEEP = ['author',
+                   'author_flair_text',
+                   'author_fullname',
+                   'collapsed',
+                   'collapsed_reason',
+                   'controversiality',
+                   'created_utc',
+                   'domain',
+                   'edited',
+                   'full_id',
+                   'id',
+                   'is_self',
+                   'is_submitter',
+                   'link_id',
+                   'locked',
+                   'no_follow',
+                   'num_comments',
+                   'num_crossposts',
+                   'over_18',
+                   'parent_id',
+                   'permalink',
+                   'post_type',
+                   'score',
+                   'scraped_on',
+                   'stickied',
+                   'subreddit',
+                   'text',
+                   'title',
+                   'total_awards_received',
+                   'url']
 
 
 def reddit_object_to_dict(x):
@@ -25,7 +60,7 @@ def reddit_object_to_dict(x):
     Parameters
     ----------
     x : Object
-        a single result from a psaw/praw results generator
+        a single result from a psaw/praw results generator, or a result dict from the pushshift api
 
     Returns
     -------
@@ -34,7 +69,9 @@ def reddit_object_to_dict(x):
 
     """
 
-    if hasattr(x, '__dict__'):
+    if isinstance(x, dict):
+        tmp = x
+    elif hasattr(x, '__dict__'):
         tmp = x.__dict__
         """
         # remove triple quotes to add call to upvote_ration
@@ -71,6 +108,75 @@ def reddit_object_to_dict(x):
     return tmp
 
 
+def reddit_objects_to_columns(objects, columns_to_keep=None):
+    """
+    Convert a batch of psaw/praw objects straight into column lists holding only the kept columns
+
+    A projection-aware alternative to reddit_object_to_dict: instead of a full dict of every field
+    per record, only the columns in columns_to_keep are built, with the same derived columns
+    (full_id, text, post_type, scraped_on).  The source objects aren't modified, and the scrape date
+    is computed once per batch.  Pass the result straight to pd.DataFrame.
+
+    Parameters
+    ----------
+    objects : iterable
+        psaw/praw results, or result dicts from the pushshift api
+    columns_to_keep : list
+        Columns to build.  default is COLUMNS_TO_KEEP
+
+    Returns
+    -------
+    columns : dict
+        dict of column name to list of values
+
+    """
+    columns_to_keep = columns_to_keep or COLUMNS_TO_KEEP
+    columns = {col: [] for col in columns_to_keep}
+
+    derived = {'author', 'subreddit', 'full_id', 'text', 'post_type', 'scraped_on'}
+    plain = [(col, columns[col]) for col in columns_to_keep if col not in derived]
+
+    def column(name):
+        # appends to a throwaway list if the column isn't wanted
+        return columns.get(name, [])
+
+    authors, subreddits = column('author'), column('subreddit')
+    full_ids, texts, post_types, scraped_ons = column('full_id'), column('text'), column('post_type'), column('scraped_on')
+
+    scraped_on = datetime.now().strftime("%Y-%m-%d")
+
+    for x in objects:
+        if isinstance(x, dict):
+            record = x
+        elif hasattr(x, '__dict__'):
+            record = vars(x)
+        else:
+            record = x.d_
+
+        for col, values in plain:
+            values.append(record.get(col))
+
+        # praw returns Redditor/Subreddit objects, psaw returns names
+        author = record.get('author')
+        authors.append(author if author is None or isinstance(author, str) else author.name)
+        subreddit = record.get('subreddit')
+        subreddits.append(subreddit if subreddit is None or isinstance(subreddit, str) else subreddit.display_name)
+
+        # Submissions have 'title', comments do not
+        if 'title' in record:
+            full_ids.append("t3_" + record['id'])
+            texts.append(record.get('selftext'))
+            post_types.append('submission')
+        else:
+            full_ids.append("t1_" + record['id'])
+            texts.append(record.get('body'))
+            post_types.append('comment')
+
+        scraped_ons.append(scraped_on)
+
+    return columns
+
+
 def reddit_df_clean(df, columns_to_keep=None):
     """
     Clean up reddint dataframe
@@ -82,12 +188,16 @@ def reddit_df_clean(df, columns_to_keep=None):
     * Makes the permalink a full URL (prepends https://reddit.com)
     * Cleans up missing values (nan, '', None)
 
+    All steps are vectorized: created_datetime_utc is a datetime64 column in UTC, the boolean columns
+    are bool, num_comments/num_crossposts are nullable Int64 and author, subreddit, post_type and domain
+    are categoricals.
+
     Parameters
     ----------
     df : pandas.DataFrame
         Pandas dataframe of comment or submissions from psaw or praw
     columns_to_keep : list
-        Columns to add to the database
+        Columns to add to the database.  default is COLUMNS_TO_KEEP
 
     Returns
     -------
@@ -99,37 +209,7 @@ def reddit_df_clean(df, columns_to_keep=None):
     df.drop_duplicates(subset=['id'], inplace=True, ignore_index=True)
 
     if not columns_to_keep:
-        # Columns wanted for smaller dataset
-        columns_to_keep = ['author',
-                           'author_flair_text',
-                           'author_fullname',
-                           'collapsed',
-                           'collapsed_reason',
-                           'controversiality',
-                           'created_utc',
-                           'domain',
-                           'edited',
-                           'full_id',
-                           'id',
-                           'is_self',
-                           'is_submitter',
-                           'link_id',
-                           'locked',
-                           'no_follow',
-                           'num_comments',
-                           'num_crossposts',
-                           'over_18',
-                           'parent_id',
-                           'permalink',
-                           'post_type',
-                           'score',
-                           'scraped_on',
-                           'stickied',
-                           'subreddit',
-                           'text',
-                           'title',
-                           'total_awards_received',
-                           'url']
+        columns_to_keep = COLUMNS_TO_KEEP
 
     available_columns = set(df.columns.values)
     columns_to_add = list(set(columns_to_keep).difference(available_columns))
@@ -138,24 +218,28 @@ def reddit_df_clean(df, columns_to_keep=None):
 
     df = df.loc[:, columns_to_keep]
 
-    df['created_datetime_utc'] = df.created_utc.apply(lambda x: datetime.fromtimestamp(x).strftime("%Y-%m-%d %H:%M:%S"))
-
+    df['created_datetime_utc'] = pd.to_datetime(pd.to_numeric(df['created_utc'], errors='coerce'), unit='s')
 
     # Add 'https://reddit.com' to permalink values such that the links are complete
     if 'permalink' in df.columns:
-        df.loc[:, 'permalink'] = 'https://reddit.com' + df['permalink']
+        df['permalink'] = 'https://reddit.com' + df['permalink']
 
-    # Convert NaN  and '' in object columns to None
-    cols = sorted(df.columns)
-    for col in cols:
-        if df[col].dtype == 'object':
-            df[col].replace({np.nan: None, '': None}, inplace=True)
+    # Convert NaN  and '' in object/string columns to None
+    for col in df.columns:
+        if pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col]):
+            values = df[col]
+            df[col] = values.where(values.notna() & values.ne(''), None)
 
     for col in ['collapsed', 'is_self', 'is_submitter', 'controversiality', 'over_18']:
-        df[col] = df[col].apply(lambda x: True if x == 1 else False)
+        df[col] = df[col].eq(1)
 
     for col in ['num_comments', 'num_crossposts']:
-        df[col] = df[col].apply(lambda x: x if not x==np.nan else None)
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+
+    # Repetitive string columns are much smaller as categoricals
+    for col in ['author', 'subreddit', 'post_type', 'domain']:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
 
     # Re-order columns alphabetically
     df.sort_index(axis=1, inplace=True)
@@ -166,6 +250,102 @@ def reddit_df_clean(df, columns_to_keep=None):
     return df
 
 
+def iter_chunks(iterable, chunk_size):
+    """
+    Split an iterable, i.e. a psaw results generator, into lists of at most chunk_size items
+
+    Parameters
+    ----------
+    iterable : iterable
+        any iterable, consumed lazily
+    chunk_size : int
+        maximum number of items per chunk
+
+    Returns
+    -------
+    generator of lists
+
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def append_jsonl(df, fout, **kwargs):
+    """
+    Append a dataframe to an open JSON lines file, one record per line
+    """
+    if df.empty:
+        return
+
+    records = df.to_json(orient='records', lines=True, **kwargs)
+    if records and not records.endswith('\n'):
+        records += '\n'
+    fout.write(records)
+    fout.flush()
+
+
+def scrape_to_jsonl(results, raw_file, clean_file, chunk_size=10000, seen_ids=None, columns_to_keep=None, mode='a'):
+    """
+    Stream psaw/praw results to raw and clean JSON lines files, one chunk at a time
+
+    Each chunk is converted with reddit_object_to_dict, appended to the raw file, cleaned with
+    reddit_df_clean and appended to the clean file, so memory use is bounded by the chunk size
+    rather than the size of the scrape.  Output is flushed after every chunk.
+
+    Without a raw file, chunks are converted with reddit_objects_to_columns instead, building only
+    the kept columns.
+
+    Parameters
+    ----------
+    results : iterable
+        psaw/praw results generator
+    raw_file : str
+        path of the JSON lines file for raw records.  None skips raw output
+    clean_file : str
+        path of the JSON lines file for cleaned records
+    chunk_size : int
+        number of results held in memory at a time
+    seen_ids : set
+        full_ids already written to the clean file.  reddit_df_clean only drops duplicates within
+        a chunk, so pass the same set across calls to drop them across chunks and scrapes
+    columns_to_keep : list
+        Columns for the clean file.  default is COLUMNS_TO_KEEP
+    mode : str
+        'a' to append to existing output files, 'w' to overwrite them.  seen_ids only covers what was
+        written in this run, so start a new scrape with 'w' rather than appending duplicates
+
+    Returns
+    -------
+    count : int
+        number of results processed
+
+    """
+    seen_ids = set() if seen_ids is None else seen_ids
+    count = 0
+
+    with (open(raw_file, mode, encoding='utf-8') if raw_file else nullcontext()) as raw_out, \
+            open(clean_file, mode, encoding='utf-8') as clean_out:
+        for chunk in iter_chunks(results, chunk_size):
+            if raw_out:
+                df = pd.DataFrame([reddit_object_to_dict(x) for x in chunk])
+                append_jsonl(df, raw_out)
+            else:
+                df = pd.DataFrame(reddit_objects_to_columns(chunk, columns_to_keep))
+
+            df = reddit_df_clean(df[~df['full_id'].isin(seen_ids)], columns_to_keep)
+            seen_ids.update(df['full_id'])
+            append_jsonl(df, clean_out, date_format='iso')
+
+            count += len(chunk)
+            print(f"{count} results saved", datetime.now())
+
+    return count
+
+
 def main():
     data_folder = "/nfs/scraped_data/raw_data/reddit_posts/"
     clean_folder = "/nfs/scraped_data/clean_data/reddit_posts/"
@@ -195,6 +375,37 @@ def main():
     #limit = 10000
     #q='coronavirus, wuhan'
 
+    # stream results to disk in chunks of this many posts.  set to None to build one dataframe in memory
+    chunk_size = 10000
+
+    # fetch day long slices of each subreddit concurrently from the pushshift api.  set to None to use psaw
+    fetch_workers = 8
+
+    if chunk_size:
+        seen_ids = set()
+
+        # the first endpoint overwrites the output of any previous run, the second appends to it
+        for mode, endpoint, search in [('w', 'submission', api.search_submissions),
+                                       ('a', 'comment', api.search_comments)]:
+            print(f"scraping {endpoint}s", datetime.now())
+            if fetch_workers:
+                results = fetch_concurrent(endpoint, sub_list, after, before, max_workers=fetch_workers)
+            else:
+                results = search(
+                    after=after,
+                    before=before,
+                    subreddit=sub_list,
+                    # limit=limit
+                )
+
+            scrape_to_jsonl(results,
+                            f"{data_folder}todayilearned_reddit_posts.json",
+                            f"{clean_folder}clean_todayilearned_reddit_posts.json",
+                            chunk_size=chunk_size,
+                            seen_ids=seen_ids,
+                            mode=mode)
+        return
+
     print("scraping submissions", datetime.now())
     posts = list(api.search_submissions(
         after=after,
@@ -230,7 +441,8 @@ def main():
     df.to_json(f"{data_folder}todayilearned_reddit_posts.json", orient='records', lines=True)
     df = reddit_df_clean(df)
 
-    df.to_json(f"{clean_folder}clean_todayilearned_reddit_posts.json", orient='records', lines=True)
+    df.to_json(f"{clean_folder}clean_todayilearned_reddit_posts.json", orient='records', lines=True,
+               date_format='iso')
 
 
 if __name__ == '__main__':
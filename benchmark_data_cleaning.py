@@ -0,0 +1,128 @@
+"""
+Benchmark for pushift_files_to_sqlite.data_cleaning and clean_batch
+
+Compares records/sec of the original per-row cleaner (unwanted authors list rebuilt on every call), the
+current per-row data_cleaning and the batch cleaner clean_batch, on a synthetic sample of decoded
+Pushshift submissions.  Records are decoded before timing, so only cleaning is measured.
+
+Usage:
+    python benchmark_data_cleaning.py [number_of_records] [repeats]      (default 500000 5)
+"""
+
+import gc
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from pushift_files_to_sqlite import data_cleaning, clean_batch
+
+
+def data_cleaning_legacy(post: dict):
+    # the original per-row cleaner, kept here for comparison
+    unwanted_authors = ['[deleted]', '[removed]', 'automoderator']
+
+    if (post['author'] in unwanted_authors) or (post['subreddit_name_prefixed'].startswith('u/')):
+        return None
+
+    if post['selftext'] == '':
+        post['selftext'] = "[NO TEXT]"
+
+    author = post['author'].lower().strip()
+
+    if post['author_flair_text']:
+        author_flair_text = post['author_flair_text'].lower().strip()
+    else:
+        author_flair_text = "none"
+
+    if post['link_flair_text']:
+        post_flair_text = post['link_flair_text'].lower().strip()
+    else:
+        post_flair_text = "none"
+
+    created_utc = post['created_utc']
+    reddit_id = f"t3_{post['id']}"
+    num_comments = post['num_comments']
+    nsfw = post['over_18']
+    score = post['score']
+    text = post['selftext']
+    subreddit = post['subreddit'].lower().strip()
+    title = post['title']
+    total_awards_received = post['total_awards_received']
+
+    return (author, author_flair_text, post_flair_text, created_utc, reddit_id, num_comments,
+            nsfw, score, text, subreddit, title, total_awards_received)
+
+
+CLEANERS = {
+    'legacy': lambda posts: [row for row in map(data_cleaning_legacy, posts) if row],
+    'per-row': lambda posts: [row for row in map(data_cleaning, posts) if row],
+    'batch': clean_batch,
+}
+
+
+def make_sample(n_records, seed=0):
+    """
+    Synthetic decoded submissions with the full set of keys of a Pushshift record, repetitive mixed case
+    authors, subreddits and flairs, and a share of deleted authors and user subreddits
+    """
+    rng = np.random.default_rng(seed)
+    authors = [f"User_{i}" for i in range(50000)] + ['[deleted]'] * 5000 + ['AutoModerator'.lower()] * 500
+    subreddits = [f"Sub_{i}" for i in range(2000)] + [f"u_User_{i}" for i in range(50)]
+    flairs = [None, '', 'Discussion ', 'Question', 'META', 'News ', 'OC']
+    filler = {f"field_{i}": None for i in range(60)}
+
+    author_idx = rng.integers(0, len(authors), n_records)
+    subreddit_idx = rng.integers(0, len(subreddits), n_records)
+    flair_idx = rng.integers(0, len(flairs), (n_records, 2))
+
+    posts = []
+    for i in range(n_records):
+        subreddit = subreddits[subreddit_idx[i]]
+        post = dict(filler)
+        post.update({
+            'author': authors[author_idx[i]],
+            'author_flair_text': flairs[flair_idx[i, 0]],
+            'link_flair_text': flairs[flair_idx[i, 1]],
+            'created_utc': 1577836800 + i,
+            'id': format(i, 'x'),
+            'num_comments': i % 300,
+            'over_18': i % 50 == 0,
+            'score': i % 1000,
+            'selftext': '' if i % 3 else f"post text {i}",
+            'subreddit': subreddit,
+            'subreddit_name_prefixed': f"u/{subreddit[2:]}" if subreddit.startswith('u_') else f"r/{subreddit}",
+            'title': f"Post title number {i}",
+            'total_awards_received': i % 7 == 0,
+        })
+        posts.append(post)
+
+    return posts
+
+
+def main():
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"Building {n_records} synthetic records...")
+    reference = CLEANERS['legacy'](make_sample(n_records))
+
+    for cleaner_name, cleaner in CLEANERS.items():
+        times = []
+        for _ in range(repeats):
+            # a fresh sample each run, as the cleaners replace empty selftext in place
+            posts = make_sample(n_records)
+            gc.collect()
+            gc.disable()
+            start = perf_counter()
+            rows = cleaner(posts)
+            times.append(perf_counter() - start)
+            gc.enable()
+
+        assert rows == reference, f"{cleaner_name} output differs from legacy"
+        print(f"{cleaner_name:>8}: {n_records / min(times):,.0f} records/sec (best of {repeats}), "
+              f"{len(rows)} kept")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark for pushift_files_to_sqlite.read_lines_zst
+
+Compares the original str based line reader with the current bytes based reader on a synthetic
+Pushshift style .zst file.  Each reader runs in a fresh subprocess so peak RSS is measured per reader (unix only).
+
+Usage:
+    python benchmark_read_lines_zst.py [number_of_lines]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import zstandard
+
+from pushift_files_to_sqlite import read_lines_zst
+
+# resource is unix only - on windows peak RSS isn't reported
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def read_lines_zst_legacy(file_name):
+    # the original str based reader, kept here for comparison
+
+    with open(file_name, 'rb') as file_handle:
+        buffer = ''
+        reader = zstandard.ZstdDecompressor(max_window_size=2 ** 31).stream_reader(file_handle)
+        while True:
+            chunk = reader.read(2 ** 27).decode()
+            if not chunk:
+                break
+            lines = (buffer + chunk).split("\n")
+
+            for line in lines[:-1]:
+                yield line
+
+            buffer = lines[-1]
+        reader.close()
+
+
+READERS = {
+    'legacy': read_lines_zst_legacy,
+    'bytes': read_lines_zst,
+}
+
+
+def make_sample_file(file_name, n_lines):
+    """
+    Write a synthetic archive file of submission-like json records, including multibyte text
+    """
+    compressor = zstandard.ZstdCompressor(level=3)
+
+    with open(file_name, 'wb') as file_handle, compressor.stream_writer(file_handle) as writer:
+        for i in range(n_lines):
+            post = {
+                'author': f"user_{i % 5000}",
+                'created_utc': 1577836800 + i,
+                'id': format(i, 'x'),
+                'selftext': "Some post text with unicode: café ✓ 日本語 " * (i % 20),
+                'subreddit': f"sub_{i % 300}",
+                'subreddit_name_prefixed': f"r/sub_{i % 300}",
+                'title': f"Post title number {i}",
+                'score': i % 1000,
+            }
+            writer.write(json.dumps(post, ensure_ascii=False).encode() + b"\n")
+
+
+def run_reader(reader_name, file_name):
+    """
+    Time a single reader over the file and report lines/sec and peak RSS as json
+    """
+    reader = READERS[reader_name]
+
+    start = perf_counter()
+    n_lines = 0
+    for _ in reader(file_name):
+        n_lines += 1
+    elapsed = perf_counter() - start
+
+    # ru_maxrss is kilobytes on linux and bytes on macos
+    peak_rss_mb = None
+    if resource is not None:
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if sys.platform == 'darwin':
+            peak_rss_mb /= 1024
+
+    print(json.dumps({'reader': reader_name, 'lines': n_lines, 'seconds': elapsed,
+                      'lines_per_sec': n_lines / elapsed, 'peak_rss_mb': peak_rss_mb}))
+
+
+def main():
+    n_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, 'RS_sample.zst')
+        print(f"Writing {n_lines} lines to {file_name}...")
+        make_sample_file(file_name, n_lines)
+
+        for reader_name in READERS:
+            output = subprocess.check_output([sys.executable, __file__, '--run', reader_name, file_name])
+            result = json.loads(output)
+            peak_rss = f", peak RSS {result['peak_rss_mb']:.0f} MiB" if result['peak_rss_mb'] is not None else ""
+            print(f"{result['reader']:>8}: {result['lines']} lines in {result['seconds']:.2f}s, "
+                  f"{result['lines_per_sec']:,.0f} lines/sec{peak_rss}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--run':
+        run_reader(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,136 @@
+"""
+Benchmark for basic_reddit_scraper.reddit_df_clean
+
+Compares the original apply/lambda based cleaning with the current vectorized version on synthetic
+psaw-like data.  Each cleaner runs in a fresh subprocess, reporting elapsed time, peak memory
+allocated while cleaning (from a second, traced run) and the memory used by the cleaned dataframe.
+
+Usage:
+    python benchmark_reddit_df_clean.py [number_of_rows ...]      (default 1000000 10000000)
+"""
+
+import json
+import subprocess
+import sys
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from basic_reddit_scraper import reddit_df_clean, COLUMNS_TO_KEEP
+
+
+def reddit_df_clean_legacy(df, columns_to_keep=None):
+    # the original row by row cleaning, kept here for comparison
+    df.drop_duplicates(subset=['id'], inplace=True, ignore_index=True)
+
+    columns_to_keep = columns_to_keep or COLUMNS_TO_KEEP
+
+    available_columns = set(df.columns.values)
+    columns_to_add = list(set(columns_to_keep).difference(available_columns))
+    for col in columns_to_add:
+        df[col] = None
+
+    df = df.loc[:, columns_to_keep]
+
+    df['created_datetime_utc'] = df.created_utc.apply(lambda x: datetime.fromtimestamp(x).strftime("%Y-%m-%d %H:%M:%S"))
+
+    if 'permalink' in df.columns:
+        df.loc[:, 'permalink'] = 'https://reddit.com' + df['permalink']
+
+    cols = sorted(df.columns)
+    for col in cols:
+        if df[col].dtype == 'object':
+            df[col] = df[col].replace({np.nan: None, '': None})
+
+    for col in ['collapsed', 'is_self', 'is_submitter', 'controversiality', 'over_18']:
+        df[col] = df[col].apply(lambda x: True if x == 1 else False)
+
+    for col in ['num_comments', 'num_crossposts']:
+        df[col] = df[col].apply(lambda x: x if not x == np.nan else None)
+
+    df.sort_index(axis=1, inplace=True)
+    df.reset_index(inplace=True, drop=True)
+
+    return df
+
+
+CLEANERS = {
+    'legacy': reddit_df_clean_legacy,
+    'vectorized': reddit_df_clean,
+}
+
+
+def make_sample_df(n_rows, seed=0):
+    """
+    Synthetic mix of submissions and comments with the columns and value types psaw returns
+    """
+    rng = np.random.default_rng(seed)
+    is_submission = rng.random(n_rows) < 0.2
+    ids = np.array([format(i, 'x') for i in range(n_rows)], dtype=object)
+
+    def maybe(values, missing=0.1):
+        values = np.array(values, dtype=object)
+        values[rng.random(n_rows) < missing] = None
+        return values
+
+    return pd.DataFrame({
+        'author': maybe(np.char.add('user_', rng.integers(0, 50000, n_rows).astype(str))),
+        'author_flair_text': maybe(np.where(rng.random(n_rows) < 0.5, '', 'flair'), 0.3),
+        'created_utc': rng.integers(1577836800, 1593561600, n_rows),
+        'domain': maybe(np.where(is_submission, 'self.todayilearned', None)),
+        'id': ids,
+        'is_self': rng.integers(0, 2, n_rows).astype(bool),
+        'num_comments': np.where(is_submission, rng.integers(0, 500, n_rows), np.nan),
+        'over_18': rng.random(n_rows) < 0.01,
+        'permalink': '/r/todayilearned/comments/' + pd.Series(ids),
+        'post_type': np.where(is_submission, 'submission', 'comment'),
+        'score': rng.integers(-10, 5000, n_rows),
+        'subreddit': np.array(['todayilearned', 'changemyview', 'unpopularopinion'])[rng.integers(0, 3, n_rows)],
+        'text': maybe(np.where(rng.random(n_rows) < 0.2, '', 'some comment text'), 0.05),
+    })
+
+
+def run_cleaner(cleaner_name, n_rows):
+    cleaner = CLEANERS[cleaner_name]
+
+    df = make_sample_df(n_rows)
+    start = perf_counter()
+    clean = cleaner(df)
+    elapsed = perf_counter() - start
+    result_mb = clean.memory_usage(deep=True).sum() / 2 ** 20
+    del clean, df
+
+    # tracing slows python allocations down, so memory is measured on a separate run
+    df = make_sample_df(n_rows)
+    tracemalloc.start()
+    cleaner(df)
+    peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+
+    print(json.dumps({'cleaner': cleaner_name, 'rows': n_rows, 'seconds': elapsed, 'peak_mb': peak_mb,
+                      'result_mb': result_mb}))
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000000, 10000000]
+
+    for n_rows in sizes:
+        results = {}
+        for cleaner_name in CLEANERS:
+            output = subprocess.check_output([sys.executable, __file__, '--run', cleaner_name, str(n_rows)])
+            results[cleaner_name] = result = json.loads(output)
+            print(f"{n_rows:>10} rows {cleaner_name:>10}: {result['seconds']:.2f}s, "
+                  f"peak {result['peak_mb']:.0f} MiB, result {result['result_mb']:.0f} MiB")
+
+        print(f"{n_rows:>10} rows speedup: {results['legacy']['seconds'] / results['vectorized']['seconds']:.1f}x, "
+              f"result memory: {results['legacy']['result_mb'] / results['vectorized']['result_mb']:.1f}x smaller")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--run':
+        run_cleaner(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
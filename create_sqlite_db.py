@@ -18,8 +18,10 @@ def get_schemas():
         strings containing schema for the db tables
     """
 
+    # users and subreddits are interned: the other tables reference them by integer id
     users_schema = """
-        author TEXT PRIMARY KEY,
+        user_id INTEGER PRIMARY KEY,
+        author TEXT UNIQUE,
         reddit_user_id TEXT,
         account_created_utc INTEGER,
         comment_karma INTEGER,
@@ -30,7 +32,8 @@ def get_schemas():
     """
 
     subreddits_schema = """
-        subreddit TEXT PRIMARY KEY,
+        subreddit_id INTEGER PRIMARY KEY,
+        subreddit TEXT UNIQUE,
         description TEXT,
         public_description TEXT,
         subreddit_created_utc INTEGER,
@@ -40,7 +43,7 @@ def get_schemas():
 
     submissions_schema = """
         record_id INTEGER PRIMARY KEY,
-        author TEXT,
+        author_id INTEGER,
         author_flair_text TEXT,
         post_flair_text TEXT,
         created_utc INTEGER,
@@ -49,15 +52,182 @@ def get_schemas():
         nsfw TEXT,
         score INTEGER,
         text TEXT,
-        subreddit TEXT,
+        subreddit_id INTEGER,
         title TEXT,
         total_awards_received INTEGER,
 
-        FOREIGN KEY (author) REFERENCES users (author),
-        FOREIGN KEY (subreddit) REFERENCES subreddits (subreddit)
+        FOREIGN KEY (author_id) REFERENCES users (user_id),
+        FOREIGN KEY (subreddit_id) REFERENCES subreddits (subreddit_id)
     """
 
-    return users_schema, subreddits_schema, submissions_schema
+    # ids are base 36 decoded reddit ids. parent_id is NULL for top level comments
+    comments_schema = """
+        comment_id INTEGER PRIMARY KEY,
+        link_id INTEGER,
+        parent_id INTEGER,
+        author_id INTEGER,
+        author_flair_text TEXT,
+        created_utc INTEGER,
+        score INTEGER,
+        text TEXT,
+        subreddit_id INTEGER,
+
+        FOREIGN KEY (author_id) REFERENCES users (user_id),
+        FOREIGN KEY (subreddit_id) REFERENCES subreddits (subreddit_id)
+    """
+
+    # tweets from twitter_scraper.keyword_scraper.  hashtags, mentions and urls are space separated
+    tweets_schema = """
+        tweet_id INTEGER PRIMARY KEY,
+        conversation_id INTEGER,
+        created_utc INTEGER,
+        user_id INTEGER,
+        username TEXT,
+        name TEXT,
+        text TEXT,
+        language TEXT,
+        replies_count INTEGER,
+        retweets_count INTEGER,
+        likes_count INTEGER,
+        hashtags TEXT,
+        mentions TEXT,
+        urls TEXT,
+        link TEXT,
+        quote_url TEXT,
+        video INTEGER
+    """
+
+    return users_schema, subreddits_schema, submissions_schema, comments_schema, tweets_schema
+
+
+def get_ledger_schema():
+    """
+    Text schema for the ingestion ledger, which tracks progress through each archive file
+
+    :return:
+        string containing schema for the ledger table
+    """
+
+    ledger_schema = """
+        archive_file TEXT PRIMARY KEY,
+        lines_read INTEGER,
+        rows_saved INTEGER,
+        completed INTEGER,
+        updated_utc INTEGER
+    """
+
+    return ledger_schema
+
+
+def get_rollup_schemas():
+    """
+    Text schemas for the pre-aggregated rollup tables, maintained by reddit_rollups
+
+    day and hour are the utc epoch seconds at the start of the day/hour
+
+    :return:
+        dict of rollup table name to schema
+    """
+
+    totals = """
+        posts INTEGER,
+        score INTEGER,
+        num_comments INTEGER,
+        total_awards_received INTEGER,
+    """
+
+    return {
+        'subreddit_daily_rollup': f"""
+            subreddit_id INTEGER,
+            day INTEGER,
+            {totals}
+            PRIMARY KEY (subreddit_id, day)
+        """,
+        'subreddit_hourly_rollup': f"""
+            subreddit_id INTEGER,
+            hour INTEGER,
+            {totals}
+            PRIMARY KEY (subreddit_id, hour)
+        """,
+        'author_subreddit_rollup': f"""
+            author_id INTEGER,
+            subreddit_id INTEGER,
+            {totals}
+            PRIMARY KEY (author_id, subreddit_id)
+        """,
+    }
+
+
+def get_fts_triggers():
+    """
+    Triggers keeping the submissions_fts full text index in sync with the submissions table
+
+    The upsert in pushift_files_to_sqlite only updates score and num_comments, so it doesn't
+    fire the update trigger.
+
+    :return:
+        dict of trigger name to trigger body
+    """
+
+    return {
+        'submissions_fts_insert': """
+            AFTER INSERT ON submissions BEGIN
+                INSERT INTO submissions_fts (rowid, title, text) VALUES (new.record_id, new.title, new.text);
+            END
+        """,
+        'submissions_fts_delete': """
+            AFTER DELETE ON submissions BEGIN
+                INSERT INTO submissions_fts (submissions_fts, rowid, title, text)
+                VALUES ('delete', old.record_id, old.title, old.text);
+            END
+        """,
+        'submissions_fts_update': """
+            AFTER UPDATE OF title, text ON submissions BEGIN
+                INSERT INTO submissions_fts (submissions_fts, rowid, title, text)
+                VALUES ('delete', old.record_id, old.title, old.text);
+                INSERT INTO submissions_fts (rowid, title, text) VALUES (new.record_id, new.title, new.text);
+            END
+        """,
+    }
+
+
+def get_indexes():
+    """
+    Secondary indexes for the sqlite tables
+
+    :return:
+        dict of table name to a dict of index name to indexed columns
+    """
+
+    return {
+        'users': {
+            'idx_c_karma': 'comment_karma',
+            'idx_s_karma': 'submission_karma',
+            'idx_t_karma': 'total_karma',
+        },
+        'subreddits': {
+            'idx_subscribers': 'subscribers',
+        },
+        'submissions': {
+            'idx_score': 'score',
+            'idx_n_com': 'num_comments',
+            'idx_sub': 'subreddit_id',
+            'idx_date': 'created_utc',
+            'idx_author': 'author_id',
+            'idx_auth_sub': 'author_id, subreddit_id',
+        },
+        'comments': {
+            'idx_link': 'link_id',
+            'idx_parent': 'parent_id',
+        },
+        'author_subreddit_rollup': {
+            'idx_rollup_sub': 'subreddit_id',
+        },
+        'tweets': {
+            'idx_tweet_date': 'created_utc',
+            'idx_username': 'username',
+        },
+    }
 
 
 """ DB FUNCTIONS """
@@ -79,32 +249,322 @@ def get_db_connection(db_file: str):
     return conn, cursor
 
 
-def create_tables(cursor):
+def create_tables(cursor, indexes=True):
     """
     Create db tables if necessary
 
     :param cursor: sqlite cursor instance
+    :param indexes: set to False to skip creating secondary indexes, i.e. before a bulk load
 
     :return:
         None
     """
-    users_schema, subreddits_schema, submissions_schema = get_schemas()
+    users_schema, subreddits_schema, submissions_schema, comments_schema, tweets_schema = get_schemas()
 
     cursor.execute(f"CREATE TABLE IF NOT EXISTS users ({users_schema})")
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_c_karma ON users(comment_karma)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_s_karma ON users(submission_karma)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_t_karma ON users(total_karma)')
-
     cursor.execute(f"CREATE TABLE IF NOT EXISTS subreddits ({subreddits_schema})")
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscribers ON subreddits(subscribers)')
-
     cursor.execute(f"CREATE TABLE IF NOT EXISTS submissions ({submissions_schema})")
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_score ON submissions(score)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_n_com ON submissions(num_comments)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sub ON submissions(subreddit)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON submissions(created_utc)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_author ON submissions(author)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_auth_sub ON submissions(author, subreddit)')
+
+    # reddit_id is the dedupe key for upserts.  older databases need remove_duplicate_submissions first
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_reddit_id ON submissions(reddit_id)')
+
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS comments ({comments_schema})")
+
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS tweets ({tweets_schema})")
+
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS ingestion_ledger ({get_ledger_schema()})")
+
+    create_rollups(cursor)
+
+    create_fts(cursor)
+
+    if indexes:
+        create_indexes(cursor)
+
+
+def create_fts(cursor, triggers=True):
+    """
+    Create the submissions_fts full text index (an external content FTS5 table over submissions) if necessary
+
+    A newly created index over an already populated submissions table is built in one pass.
+
+    :param cursor: sqlite cursor instance
+    :param triggers: set to False to skip the sync triggers, i.e. before a bulk load
+
+    :return:
+        None
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE name = 'submissions_fts'")
+    exists = cursor.fetchone() is not None
+
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS submissions_fts
+        USING fts5(title, text, content='submissions', content_rowid='record_id')
+    """)
+
+    if triggers:
+        for trigger_name, trigger in get_fts_triggers().items():
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {trigger_name} {trigger}")
+
+    if not exists:
+        rebuild_fts(cursor)
+
+
+def create_rollups(cursor):
+    """
+    Create the rollup tables (see reddit_rollups) if necessary
+
+    Newly created rollups over an already populated submissions table are filled in one pass, as
+    update_rollups only sees the batches loaded after them.
+
+    :param cursor: sqlite cursor instance
+
+    :return:
+        None
+    """
+    rollup_schemas = get_rollup_schemas()
+
+    cursor.execute(f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN "
+                   f"({','.join('?' * len(rollup_schemas))})", list(rollup_schemas))
+    exists = len(cursor.fetchall()) == len(rollup_schemas)
+
+    for table, schema in rollup_schemas.items():
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({schema}) WITHOUT ROWID")
+
+    if not exists:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM submissions)")
+        if cursor.fetchone()[0]:
+            rebuild_rollup_tables(cursor)
+
+
+def rebuild_rollup_tables(cursor):
+    """
+    Recompute every rollup table from the submissions table
+
+    :param cursor: sqlite cursor instance
+
+    :return:
+        None
+    """
+    totals = "COUNT(*), COALESCE(SUM(score), 0), COALESCE(SUM(num_comments), 0), " \
+             "COALESCE(SUM(total_awards_received), 0)"
+
+    cursor.execute("DELETE FROM subreddit_daily_rollup")
+    cursor.execute(f"""
+        INSERT INTO subreddit_daily_rollup
+        SELECT subreddit_id, created_utc - created_utc % 86400 AS day, {totals}
+        FROM submissions GROUP BY subreddit_id, day
+    """)
+
+    cursor.execute("DELETE FROM subreddit_hourly_rollup")
+    cursor.execute(f"""
+        INSERT INTO subreddit_hourly_rollup
+        SELECT subreddit_id, created_utc - created_utc % 3600 AS hour, {totals}
+        FROM submissions GROUP BY subreddit_id, hour
+    """)
+
+    cursor.execute("DELETE FROM author_subreddit_rollup")
+    cursor.execute(f"""
+        INSERT INTO author_subreddit_rollup
+        SELECT author_id, subreddit_id, {totals}
+        FROM submissions GROUP BY author_id, subreddit_id
+    """)
+
+
+def drop_fts_triggers(cursor):
+    """
+    Drop the full text sync triggers, so a bulk load doesn't index row by row.  Follow with rebuild_fts
+
+    :param cursor: sqlite cursor instance
+
+    :return:
+        None
+    """
+    for trigger_name in get_fts_triggers():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+
+
+def rebuild_fts(cursor):
+    """
+    Rebuild the full text index from the submissions table in one pass
+
+    :param cursor: sqlite cursor instance
+
+    :return:
+        None
+    """
+    cursor.execute("INSERT INTO submissions_fts (submissions_fts) VALUES ('rebuild')")
+
+
+def create_indexes(cursor, tables=None):
+    """
+    Create secondary indexes if necessary
+
+    :param cursor: sqlite cursor instance
+    :param tables: list of table names to index.  default is all tables
+
+    :return:
+        None
+    """
+    for table, indexes in get_indexes().items():
+        if tables and table not in tables:
+            continue
+
+        for index_name, columns in indexes.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table}({columns})")
+
+
+def drop_indexes(cursor, tables=None):
+    """
+    Drop secondary indexes, i.e. so a bulk load doesn't have to maintain them row by row
+
+    :param cursor: sqlite cursor instance
+    :param tables: list of table names to drop indexes from.  default is all tables
+
+    :return:
+        None
+    """
+    for table, indexes in get_indexes().items():
+        if tables and table not in tables:
+            continue
+
+        for index_name in indexes:
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+
+def remove_duplicate_submissions(cursor):
+    """
+    Delete duplicate submissions left by reruns before reddit_id was unique, keeping the latest copy
+
+    :param cursor: sqlite cursor instance
+
+    :return:
+        number of rows deleted
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'submissions'")
+    if not cursor.fetchone():
+        return 0
+
+    cursor.execute("""
+        DELETE FROM submissions
+        WHERE record_id NOT IN (SELECT MAX(record_id) FROM submissions GROUP BY reddit_id)
+    """)
+
+    return cursor.rowcount
+
+
+def migrate_to_interned_keys(conn):
+    """
+    Migrate a database with TEXT author/subreddit columns to integer user_id/subreddit_id keys
+
+    Every table is rebuilt in a single transaction, rolled back if any step fails, then the file is
+    vacuumed to reclaim the space used by the repeated strings.  Databases already using integer keys
+    are left alone.
+
+    :param conn: sqlite connection instance
+
+    :return:
+        True if the database was migrated
+    """
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT name FROM pragma_table_info('submissions')")
+    if 'author' not in {row[0] for row in cursor.fetchall()}:
+        return False
+
+    users_schema, subreddits_schema, submissions_schema, comments_schema, _ = get_schemas()
+
+    # sqlite3 doesn't begin a transaction before DDL, so it is begun explicitly - otherwise CREATE TABLE
+    # autocommits.  pending work (i.e. removed duplicates) is committed first, as transactions can't nest
+    conn.commit()
+    cursor.execute("BEGIN")
+    try:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'comments'")
+        has_comments = cursor.fetchone() is not None
+
+        cursor.execute(f"CREATE TABLE users_new ({users_schema})")
+        cursor.execute("""
+            INSERT INTO users_new (author, reddit_user_id, account_created_utc, comment_karma, submission_karma,
+                                   total_karma, verified_email, icon_image_url)
+            SELECT author, reddit_user_id, account_created_utc, comment_karma, submission_karma,
+                   total_karma, verified_email, icon_image_url
+            FROM users
+        """)
+
+        cursor.execute(f"CREATE TABLE subreddits_new ({subreddits_schema})")
+        cursor.execute("""
+            INSERT INTO subreddits_new (subreddit, description, public_description, subreddit_created_utc,
+                                        subscribers, nsfw)
+            SELECT subreddit, description, public_description, subreddit_created_utc, subscribers, nsfw
+            FROM subreddits
+        """)
+
+        cursor.execute(f"CREATE TABLE submissions_new ({submissions_schema})")
+        cursor.execute("""
+            INSERT INTO submissions_new
+            SELECT s.record_id, u.user_id, s.author_flair_text, s.post_flair_text, s.created_utc, s.reddit_id,
+                   s.num_comments, s.nsfw, s.score, s.text, r.subreddit_id, s.title, s.total_awards_received
+            FROM submissions s
+            LEFT JOIN users_new u ON u.author = s.author
+            LEFT JOIN subreddits_new r ON r.subreddit = s.subreddit
+        """)
+
+        if has_comments:
+            cursor.execute(f"CREATE TABLE comments_new ({comments_schema})")
+            cursor.execute("""
+                INSERT INTO comments_new
+                SELECT c.comment_id, c.link_id, c.parent_id, u.user_id, c.author_flair_text, c.created_utc,
+                       c.score, c.text, r.subreddit_id
+                FROM comments c
+                LEFT JOIN users_new u ON u.author = c.author
+                LEFT JOIN subreddits_new r ON r.subreddit = c.subreddit
+            """)
+
+        # dropping the old tables drops their indexes too - create_tables rebuilds them
+        for table in ['submissions', 'comments', 'users', 'subreddits']:
+            if table == 'comments' and not has_comments:
+                continue
+            cursor.execute(f"DROP TABLE {table}")
+            cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+        create_tables(cursor)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+    cursor.execute("VACUUM")
+
+    return True
+
+
+def setup_database(conn, indexes=True):
+    """
+    Bring a new or existing database up to the current schema
+
+    :param conn: sqlite connection instance
+    :param indexes: set to False to skip creating secondary indexes, i.e. before a bulk load
+
+    :return:
+        None
+    """
+    cursor = conn.cursor()
+
+    # databases from before the unique reddit_id index may hold duplicates from reruns, which would block it.
+    # once the index exists there can't be any, so the full table scan only runs once
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'idx_reddit_id'")
+    if not cursor.fetchone():
+        removed = remove_duplicate_submissions(cursor)
+        if removed:
+            print(f"Removed {removed} duplicate submissions")
+
+    # existing databases with TEXT author/subreddit columns are moved to integer keys
+    if migrate_to_interned_keys(conn):
+        print("Migrated authors and subreddits to integer keys")
+
+    # create tables if necessary
+    create_tables(cursor, indexes)
+    conn.commit()
 
 
 def main():
@@ -113,9 +573,7 @@ def main():
 
     conn, cursor = get_db_connection(db_file)
 
-    # create tables if necessary
-    create_tables(cursor)
-    conn.commit()
+    setup_database(conn)
 
 
 if __name__ == '__main__':
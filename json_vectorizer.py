@@ -0,0 +1,262 @@
+"""
+Streaming sparse vectorization of nested JSON records
+
+explore_vectorize_json loads a whole json file, flattens each record with flatten_dict, joins it into a
+string with flat_to_string, fits a CountVectorizer(token_pattern='\\S+', binary=True) and then densifies
+the matrix with X.toarray().  This module builds the same binary record x attribute matrix while
+streaming JSON lines:
+* records are flattened with an explicit stack rather than recursion
+* attribute tokens go straight into CSR column/row pointer arrays - the flat string is never built
+* tokens are dictionary encoded (the same sorted vocabulary and columns as CountVectorizer) or hashed
+  into a fixed number of columns, for a single pass without holding a vocabulary
+* the matrix stays sparse, memory is proportional to its non zeros
+* the vocabulary is saved as plain text, one attribute per line, rather than pickling the vectorizer
+
+Tokens match flat_to_string + CountVectorizer: "<key>.<value>", or just "<key>" for 0/1/True/False
+values, lower cased and split on whitespace.
+"""
+
+import gzip
+import zlib
+from array import array
+from collections import defaultdict
+from datetime import datetime
+from itertools import count
+
+import numpy as np
+from scipy import sparse
+
+from pushift_files_to_sqlite import read_lines_plain, read_lines_zst
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    import json
+    loads = json.loads
+
+# values written as just their key by flat_to_string
+_FLAG_TYPES = (bool, int, float)
+
+""" FLATTEN FUNCTIONS """
+
+
+def flatten_record(record, sep='.'):
+    """
+    Iterative equivalent of the notebook's flatten_dict
+
+    :param record: dict of nested dicts
+    :param sep: separator between parent and child keys
+
+    :return:
+        generator of (flattened key, value) tuples, in flatten_dict order
+    """
+    stack = [('', iter(record.items()))]
+
+    while stack:
+        parent_key, items = stack[-1]
+        for key, value in items:
+            key = parent_key + sep + key if parent_key else key
+            if isinstance(value, dict):
+                # descend, then resume this dict's items once the child is done
+                stack.append((key, iter(value.items())))
+                break
+            yield key, value
+        else:
+            stack.pop()
+
+
+def record_tokens(record, sep='.', lowercase=True):
+    """
+    :param record: dict of nested dicts
+    :param sep: separator between parent and child keys
+    :param lowercase: lower case tokens, as CountVectorizer does by default
+
+    :return:
+        set of the record's attribute tokens
+    """
+    tokens = set()
+    add = tokens.add
+
+    # flatten_record inlined, as this runs for every attribute of every record
+    stack = [('', iter(record.items()))]
+    while stack:
+        parent_key, items = stack[-1]
+        for key, value in items:
+            key = parent_key + sep + key if parent_key else key
+            if value.__class__ is dict:
+                stack.append((key, iter(value.items())))
+                break
+
+            if value.__class__ in _FLAG_TYPES and (value == 0 or value == 1):
+                token = key
+            else:
+                token = f"{key}.{value}"
+            if lowercase:
+                token = token.lower()
+
+            # values containing whitespace become several tokens, as with CountVectorizer's \S+ pattern
+            parts = token.split()
+            if len(parts) == 1:
+                add(parts[0])
+            else:
+                tokens.update(parts)
+        else:
+            stack.pop()
+
+    return tokens
+
+
+""" VECTORIZE FUNCTIONS """
+
+
+def hash_token(token, n_features):
+    """
+    Column of a token when hashing - crc32, as python's hash() differs between processes
+    """
+    return zlib.crc32(token.encode('utf-8')) % n_features
+
+
+def vectorize_records(records, vocabulary=None, n_features=None, sep='.', lowercase=True, sort_vocabulary=True,
+                      dtype=np.int32):
+    """
+    Build the binary record x attribute CSR matrix
+
+    Three modes:
+    * default - learn the vocabulary while streaming, as CountVectorizer.fit_transform
+    * vocabulary - a fixed vocabulary, attributes not in it are ignored, as CountVectorizer.transform
+    * n_features - hash attributes into n_features columns, no vocabulary is kept
+
+    :param records: iterable of dicts
+    :param vocabulary: list of attribute tokens, i.e. from load_vocabulary
+    :param n_features: number of columns to hash into
+    :param sep: separator between parent and child keys
+    :param lowercase: lower case tokens, as CountVectorizer does by default
+    :param sort_vocabulary: sort a learned vocabulary and its columns alphabetically, as CountVectorizer does
+    :param dtype: dtype of the matrix values
+
+    :return:
+        scipy.sparse CSR matrix and the list of attribute tokens for its columns (None when hashing)
+    """
+    # column indices of every non zero and each row's start, as compact C arrays
+    indices = array('i')
+    indptr = array('q', [0])
+    learned = vocabulary is None and not n_features
+
+    if n_features:
+        for record in records:
+            indices.extend({hash_token(token, n_features) for token in record_tokens(record, sep, lowercase)})
+            indptr.append(len(indices))
+        vocabulary = None
+
+    elif vocabulary is not None:
+        index = {token: i for i, token in enumerate(vocabulary)}
+        n_features = len(vocabulary)
+        for record in records:
+            tokens = record_tokens(record, sep, lowercase)
+            indices.extend(index[token] for token in tokens if token in index)
+            indptr.append(len(indices))
+
+    else:
+        # unseen tokens are numbered in order of first appearance
+        index = defaultdict(count().__next__)
+        for record in records:
+            indices.extend(map(index.__getitem__, record_tokens(record, sep, lowercase)))
+            indptr.append(len(indices))
+        vocabulary = list(index)
+        n_features = len(vocabulary)
+
+    indices = np.frombuffer(indices, dtype=np.int32)
+    indptr = np.frombuffer(indptr, dtype=np.int64)
+
+    if learned and sort_vocabulary:
+        # columns were numbered in order of first appearance, renumber them alphabetically
+        order = sorted(range(n_features), key=vocabulary.__getitem__)
+        column = np.empty(n_features, dtype=np.int32)
+        column[order] = np.arange(n_features, dtype=np.int32)
+        indices = column[indices]
+        vocabulary = [vocabulary[i] for i in order]
+
+    matrix = sparse.csr_matrix((np.ones(len(indices), dtype=dtype), indices, indptr),
+                               shape=(len(indptr) - 1, n_features))
+    matrix.sort_indices()
+
+    return matrix, vocabulary
+
+
+def iter_jsonl(file_name):
+    """
+    Stream the records of a JSON lines file, zstandard compressed if it ends in .zst
+
+    :param file_name: filepath to the file
+
+    :return:
+        generator of dicts
+    """
+    lines = read_lines_zst(file_name) if file_name.endswith('.zst') else read_lines_plain(file_name)
+
+    for line in lines:
+        yield loads(line)
+
+
+def vectorize_jsonl(file_names, vocabulary=None, n_features=None, sep='.', lowercase=True, sort_vocabulary=True,
+                    dtype=np.int32):
+    """
+    Build the binary record x attribute CSR matrix of one or more JSON lines files, one row per line in
+    file order.  See vectorize_records for the parameters
+
+    :return:
+        scipy.sparse CSR matrix and the list of attribute tokens for its columns (None when hashing)
+    """
+    if isinstance(file_names, str):
+        file_names = [file_names]
+
+    records = (record for file_name in file_names for record in iter_jsonl(file_name))
+
+    return vectorize_records(records, vocabulary, n_features, sep, lowercase, sort_vocabulary, dtype)
+
+
+""" SAVE/LOAD FUNCTIONS """
+
+
+def save_vocabulary(vocabulary, file_name):
+    """
+    Save the vocabulary as utf-8 text, one attribute per line in column order, gzipped if the file name
+    ends in .gz.  Tokens never contain whitespace, so no escaping is needed
+    """
+    opener = gzip.open if file_name.endswith('.gz') else open
+
+    with opener(file_name, 'wt', encoding='utf-8') as fout:
+        fout.writelines(f"{token}\n" for token in vocabulary)
+
+
+def load_vocabulary(file_name):
+    """
+    :return:
+        list of attribute tokens saved by save_vocabulary
+    """
+    opener = gzip.open if file_name.endswith('.gz') else open
+
+    with opener(file_name, 'rt', encoding='utf-8') as fin:
+        return fin.read().split('\n')[:-1]
+
+
+def main():
+    start_time = datetime.now()
+
+    json_file = input("JSON lines file: ")
+    out_prefix = input("Output file prefix: ")
+    n_features = input("Number of hashed features (leave blank to learn a vocabulary): ")
+
+    matrix, vocabulary = vectorize_jsonl(json_file, n_features=int(n_features) if n_features else None)
+
+    sparse.save_npz(f"{out_prefix}_matrix.npz", matrix)
+    if vocabulary is not None:
+        save_vocabulary(vocabulary, f"{out_prefix}_vocabulary.txt.gz")
+
+    print(f"{matrix.shape[0]} records x {matrix.shape[1]} attributes, {matrix.nnz} non zeros")
+    print(f"Time Elapsed: {((datetime.now() - start_time).total_seconds())/60} minutes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Columnar Parquet output for the Pushshift archive pipeline
+
+The etl functions in pushift_files_to_sqlite accept extra sinks.  A ParquetSink receives the same
+cleaned tuples that are inserted into sqlite, so one pass over an archive file feeds both outputs and
+each file is decompressed only once.
+
+Output is a hive partitioned dataset per record type, i.e.
+    <root>/submissions/subreddit=askreddit/month=2020-01/part-....parquet
+
+author is dictionary encoded and every row group carries min/max statistics, so full scans such as
+score or num_comments distributions per subreddit read only the columns and partitions they need.
+
+Note: Parquet output isn't tracked by the ingestion ledger.  Rows buffered in the sink when a run
+crashes are lost, and rows flushed after the last sqlite checkpoint are written again on resume.
+"""
+
+import os
+import uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# column names, in the order of the tuples from data_cleaning and comment_data_cleaning
+COLUMNS = {
+    'submissions': ['author', 'author_flair_text', 'post_flair_text', 'created_utc', 'reddit_id', 'num_comments',
+                    'nsfw', 'score', 'text', 'subreddit', 'title', 'total_awards_received'],
+    'comments': ['comment_id', 'link_id', 'parent_id', 'author', 'author_flair_text', 'created_utc', 'score',
+                 'text', 'subreddit'],
+    'tweets': ['tweet_id', 'conversation_id', 'created_utc', 'user_id', 'username', 'name', 'text', 'language',
+               'replies_count', 'retweets_count', 'likes_count', 'hashtags', 'mentions', 'urls', 'link',
+               'quote_url', 'video'],
+}
+
+# the json decoder can pass through numeric strings from older dumps, so integer columns are coerced
+INTEGER_COLUMNS = {'created_utc', 'num_comments', 'score', 'total_awards_received', 'comment_id', 'link_id',
+                   'parent_id', 'tweet_id', 'conversation_id', 'user_id', 'replies_count', 'retweets_count',
+                   'likes_count'}
+
+
+class ParquetSink:
+    """
+    Buffer cleaned tuples and write them to a partitioned Parquet dataset
+
+    :param root_path: folder for the dataset.  submissions and comments are written to subfolders
+    :param partition_cols: columns to partition by.  'month' (yyyy-mm) is derived from created_utc.
+        columns a record type doesn't have (i.e. subreddit for tweets) are left out of its partitioning
+    :param rows_per_flush: number of buffered rows per record type before writing files
+    """
+
+    def __init__(self, root_path, partition_cols=('subreddit', 'month'), rows_per_flush=1000000):
+        if pa is None:
+            raise ImportError("ParquetSink requires the pyarrow package")
+
+        self.root_path = root_path
+        self.partition_cols = list(partition_cols)
+        self.rows_per_flush = rows_per_flush
+        self.buffers = {record_type: [] for record_type in COLUMNS}
+
+    def write_batch(self, batch, record_type='submissions'):
+        """
+        Add a batch of cleaned tuples, flushing to disk once enough rows are buffered
+
+        :param batch: list of cleaned tuples from data_cleaning, comment_data_cleaning or tweet_data_cleaning
+        :param record_type: 'submissions', 'comments' or 'tweets'
+
+        :return:
+            None
+        """
+        buffer = self.buffers[record_type]
+        buffer.extend(batch)
+
+        if len(buffer) >= self.rows_per_flush:
+            self.flush(record_type)
+
+    def to_table(self, rows, record_type='submissions'):
+        """
+        Build an arrow table from cleaned tuples, column by column
+
+        :param rows: list of cleaned tuples
+        :param record_type: 'submissions', 'comments' or 'tweets'
+
+        :return:
+            pyarrow.Table
+        """
+        arrays = {}
+
+        for name, values in zip(COLUMNS[record_type], zip(*rows)):
+            if name in INTEGER_COLUMNS:
+                arrays[name] = pa.array([None if value is None else int(value) for value in values], pa.int64())
+            elif name in ('nsfw', 'video'):
+                arrays[name] = pa.array(values, pa.bool_())
+            else:
+                arrays[name] = pa.array(values, pa.string())
+
+        author_column = 'username' if record_type == 'tweets' else 'author'
+        arrays[author_column] = arrays[author_column].dictionary_encode()
+        arrays['month'] = pc.strftime(arrays['created_utc'].cast(pa.timestamp('s')), format='%Y-%m')
+
+        return pa.table(arrays)
+
+    def flush(self, record_type=None):
+        """
+        Write buffered rows to the dataset
+
+        :param record_type: 'submissions', 'comments' or 'tweets'.  default flushes all
+
+        :return:
+            None
+        """
+        record_types = [record_type] if record_type else list(self.buffers)
+
+        for record_type in record_types:
+            rows = self.buffers[record_type]
+            if not rows:
+                continue
+
+            table = self.to_table(rows, record_type)
+            partition_cols = [col for col in self.partition_cols if col in table.column_names]
+
+            # a monthly dump covers thousands of subreddits, more than pyarrow's default limit of 1024
+            # partitions per write.  rows are sorted by partition, so when there are more partitions than
+            # open files each file is finished before it is closed
+            n_partitions = table.group_by(partition_cols).aggregate([]).num_rows if partition_cols else 1
+            if partition_cols:
+                table = table.sort_by([(col, 'ascending') for col in partition_cols])
+
+            # unique file names so later flushes add files rather than overwrite them
+            pq.write_to_dataset(table, os.path.join(self.root_path, record_type),
+                                partition_cols=partition_cols,
+                                max_partitions=max(n_partitions, 1024),
+                                basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                                existing_data_behavior='overwrite_or_ignore',
+                                use_dictionary=True,
+                                write_statistics=True,
+                                compression='zstd')
+
+            self.buffers[record_type] = []
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,221 @@
+"""
+Concurrent, time sliced fetching from the Pushshift search API
+
+A single paginated psaw query over a long window spends most of its time waiting on round trips.
+This module splits the after/before window into time slices x subreddits and fetches the slices
+concurrently from a thread pool, with
+* a global rate limiter shared by every worker
+* retries with exponential backoff for failed requests
+* de-duplication on full_id (t3_ / t1_ + id) when merging slices
+
+The HTTP layer is a plain function get_json(url, params) -> dict, so a fake can be passed in to test
+against a local server or canned responses.
+"""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+PUSHSHIFT_URL = "https://api.pushshift.io/reddit/search/{endpoint}/"
+
+# full_id prefixes by endpoint
+ID_PREFIXES = {'submission': 't3_', 'comment': 't1_'}
+
+
+class RateLimiter:
+    """
+    Thread safe limiter spacing calls evenly at no more than requests_per_second across all threads
+
+    :param requests_per_second: allowed request rate
+    :param clock: monotonic clock function, replaceable for testing
+    :param sleep: sleep function, replaceable for testing
+    """
+
+    def __init__(self, requests_per_second=1.0, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / requests_per_second
+        self.clock = clock
+        self.sleep = sleep
+        self.next_slot = clock()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the caller may make its request
+        """
+        with self.lock:
+            now = self.clock()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+
+        if slot > now:
+            self.sleep(slot - now)
+
+
+def http_get_json(url, params, timeout=30):
+    """
+    Default HTTP layer: GET url with query params and decode the json response
+
+    :param url: url to request
+    :param params: dict of query parameters
+    :param timeout: seconds to wait for the server
+
+    :return:
+        decoded json response
+    """
+    query = urllib.parse.urlencode(params, doseq=True)
+    request = urllib.request.Request(f"{url}?{query}", headers={'User-Agent': 'python_samples pushshift fetcher'})
+
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def get_with_retry(get_json, url, params, rate_limiter, max_retries=5, backoff=2.0, sleep=time.sleep):
+    """
+    Rate limited request, retried with exponential backoff
+
+    :param get_json: HTTP layer function, get_json(url, params) -> dict
+    :param url: url to request
+    :param params: dict of query parameters
+    :param rate_limiter: RateLimiter shared by all workers
+    :param max_retries: number of retries before giving up
+    :param backoff: seconds to wait before the first retry, doubled for each retry after
+    :param sleep: sleep function, replaceable for testing
+
+    :return:
+        decoded json response
+    """
+    for attempt in range(max_retries + 1):
+        rate_limiter.wait()
+        try:
+            return get_json(url, params)
+        except (urllib.error.URLError, TimeoutError, ConnectionError, ValueError) as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"Request failed ({e}). Retrying in {delay} seconds")
+            sleep(delay)
+
+
+def time_slices(after, before, slice_seconds=86400):
+    """
+    Split the after/before window into consecutive (after, before) slices
+
+    after and before are both exclusive in the api, so each slice's before is one second past the
+    next slice's after - otherwise posts made exactly on a boundary would fall in neither slice.
+
+    :param after: utc epoch seconds the window starts after
+    :param before: utc epoch seconds the window ends before
+    :param slice_seconds: length of each slice
+
+    :return:
+        list of (after, before) tuples
+    """
+    return [(start, min(start + slice_seconds + 1, before)) for start in range(after, before, slice_seconds)]
+
+
+def fetch_slice(get_json, endpoint, subreddit, after, before, rate_limiter, size=100, max_retries=5,
+                backoff=2.0, base_url=PUSHSHIFT_URL):
+    """
+    Page through one subreddit and time slice, oldest first
+
+    :param get_json: HTTP layer function, get_json(url, params) -> dict
+    :param endpoint: 'submission' or 'comment'
+    :param subreddit: subreddit name
+    :param after: utc epoch seconds the slice starts after
+    :param before: utc epoch seconds the slice ends before
+    :param rate_limiter: RateLimiter shared by all workers
+    :param size: results per request
+    :param max_retries: retries per request - see get_with_retry
+    :param backoff: initial retry delay - see get_with_retry
+    :param base_url: search url template with an {endpoint} placeholder
+
+    :return:
+        list of result dicts
+    """
+    url = base_url.format(endpoint=endpoint)
+    results = []
+
+    while after < before:
+        params = {'subreddit': subreddit, 'after': after, 'before': before, 'size': size,
+                  'sort': 'asc', 'sort_type': 'created_utc'}
+        data = get_with_retry(get_json, url, params, rate_limiter, max_retries, backoff)['data']
+
+        if not data:
+            break
+
+        results.extend(data)
+
+        if len(data) < size:
+            break
+
+        # re-request the last second in case the page ended partway through it - duplicates are dropped
+        # when merging.  if the whole page shares one second, move on rather than loop forever
+        last = int(data[-1]['created_utc'])
+        after = last - 1 if last - 1 > after else last
+
+    return results
+
+
+def fetch_concurrent(endpoint, subreddits, after, before, slice_seconds=86400, max_workers=8,
+                     requests_per_second=1.0, get_json=http_get_json, size=100, max_retries=5, backoff=2.0,
+                     base_url=PUSHSHIFT_URL):
+    """
+    Fetch every subreddit x time slice concurrently, yielding de-duplicated results as slices finish
+
+    Results come back grouped by slice, in completion order rather than time order.
+
+    :param endpoint: 'submission' or 'comment'
+    :param subreddits: list of subreddit names
+    :param after: utc epoch seconds the window starts after
+    :param before: utc epoch seconds the window ends before
+    :param slice_seconds: length of each time slice
+    :param max_workers: number of concurrent requests in flight
+    :param requests_per_second: global request rate across all workers
+    :param get_json: HTTP layer function, get_json(url, params) -> dict.  default uses urllib
+    :param size: results per request
+    :param max_retries: retries per request - see get_with_retry
+    :param backoff: initial retry delay - see get_with_retry
+    :param base_url: search url template with an {endpoint} placeholder
+
+    :return:
+        generator of result dicts, unique on full_id
+    """
+    prefix = ID_PREFIXES[endpoint]
+    rate_limiter = RateLimiter(requests_per_second)
+    seen_ids = set()
+
+    slices = ((subreddit, slice_after, slice_before)
+              for subreddit in subreddits
+              for slice_after, slice_before in time_slices(after, before, slice_seconds))
+
+    # slices are submitted as others finish, so at most max_in_flight slices' results are held at once,
+    # and each finished future is dropped as soon as its results are yielded
+    max_in_flight = max_workers * 2
+    in_flight = set()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    try:
+        while True:
+            for subreddit, slice_after, slice_before in islice(slices, max_in_flight - len(in_flight)):
+                in_flight.add(executor.submit(fetch_slice, get_json, endpoint, subreddit, slice_after, slice_before,
+                                              rate_limiter, size, max_retries, backoff, base_url))
+            if not in_flight:
+                return
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                for result in future.result():
+                    full_id = prefix + result['id']
+                    if full_id in seen_ids:
+                        continue
+                    seen_ids.add(full_id)
+                    yield result
+
+    finally:
+        # on an error or an early close, queued slices are cancelled and only running requests are waited for
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,250 @@
+"""
+Comment thread reconstruction over the pushshift sqlite database
+
+The synonym notebooks load a reddit_comment_tree_text dataset: one document per submission holding
+the text of its whole comment tree.  Rather than walking parent_id chains one query per comment, this
+module
+* fetches every comment of a batch of submissions in one query on the link_id index, or streams the
+  whole comments table in link_id order
+* rebuilds each tree with arrays: parent positions come from a searchsorted over the thread's sorted
+  comment ids, and children are grouped with a counting sort rather than nested dicts
+* streams each thread out as JSON lines of flattened text, replies following the comment they reply to
+
+Comments whose parent isn't in the database (i.e. rejected by comment_data_cleaning) are treated as
+top level comments of their thread.
+"""
+
+import json
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+
+from create_sqlite_db import get_db_connection
+
+# comment bodies left out of the flattened text
+SKIPPED_TEXTS = frozenset(['[deleted]', '[removed]'])
+
+""" TREE FUNCTIONS """
+
+
+def int_to_base36(value):
+    """
+    Encode an integer id as a reddit base 36 id - the inverse of pushift_files_to_sqlite.base36_to_int
+    """
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    encoded = ''
+
+    while True:
+        value, remainder = divmod(value, 36)
+        encoded = digits[remainder] + encoded
+        if not value:
+            return encoded
+
+
+def assemble_thread(comment_ids, parent_ids, created_utc):
+    """
+    Rebuild one comment tree from flat arrays
+
+    :param comment_ids: int64 array of comment ids
+    :param parent_ids: int64 array of parent comment ids, -1 for top level comments
+    :param created_utc: int64 array of comment times, used to order replies oldest first
+
+    :return:
+        parent_index: position of each comment's parent, -1 for top level comments
+        order: comment positions in depth first order, each reply after the comment it replies to
+        depth: depth of each comment, 0 for top level comments
+    """
+    n_comments = len(comment_ids)
+
+    # position of each parent among the thread's comments, via the sorted comment ids
+    sort_ids = np.argsort(comment_ids, kind='stable')
+    sorted_ids = comment_ids[sort_ids]
+    found = np.searchsorted(sorted_ids, parent_ids).clip(max=n_comments - 1)
+    parent_index = np.where(sorted_ids[found] == parent_ids, sort_ids[found], -1)
+
+    # children grouped by parent (top level first), oldest first - a CSR layout of the tree
+    children = np.lexsort((created_utc, parent_index))
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(parent_index + 1, minlength=n_comments + 1))))
+
+    # iterative depth first walk over plain lists, as indexing numpy arrays one element at a time is slow.
+    # the stack holds positions, pushed in reverse so the oldest pops first
+    children, offsets = children.tolist(), offsets.tolist()
+    order = []
+    depth = [0] * n_comments
+
+    stack = children[offsets[0]:offsets[1]][::-1]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+
+        start, end = offsets[node + 1], offsets[node + 2]
+        if start < end:
+            replies = children[start:end]
+            for reply in replies:
+                depth[reply] = depth[node] + 1
+            stack.extend(reversed(replies))
+
+    return parent_index, np.array(order, dtype=np.int64), np.array(depth, dtype=np.int64)
+
+
+def flatten_thread(texts, order, title=None, submission_text=None, separator='\n'):
+    """
+    :param texts: list of comment bodies
+    :param order: comment positions in the order to join them - see assemble_thread
+    :param title: submission title to start the document with
+    :param submission_text: submission text to follow the title
+    :param separator: string between comments
+
+    :return:
+        the thread as a single string
+    """
+    parts = [part for part in (title, submission_text) if part and part not in SKIPPED_TEXTS and part != '[NO TEXT]']
+    parts.extend(texts[i] for i in order.tolist() if texts[i] and texts[i] not in SKIPPED_TEXTS)
+
+    return separator.join(parts)
+
+
+def _thread_from_rows(rows):
+    # rows of (link_id, comment_id, parent_id, created_utc, text) for a single thread
+    _, comment_ids, parent_ids, created_utc, texts = zip(*rows)
+
+    parent_ids = np.array([-1 if parent_id is None else parent_id for parent_id in parent_ids], dtype=np.int64)
+    parent_index, order, depth = assemble_thread(np.array(comment_ids, dtype=np.int64), parent_ids,
+                                                 np.array(created_utc, dtype=np.int64))
+
+    return {'comment_ids': comment_ids, 'parent_index': parent_index, 'order': order, 'depth': depth,
+            'texts': texts}
+
+
+""" QUERY FUNCTIONS """
+
+
+def iter_threads(cursor, link_ids=None, batch_size=500, fetch_size=100000):
+    """
+    Fetch and rebuild comment threads
+
+    With link_ids, each batch of submissions is fetched with a single query on the link_id index.
+    Without, the whole comments table is streamed in link_id order by one index scan.
+
+    :param cursor: sqlite cursor object
+    :param link_ids: list of integer (base 36 decoded) submission ids.  default is every thread
+    :param batch_size: submissions per query, at most 999
+    :param fetch_size: rows fetched from sqlite at a time when streaming every thread
+
+    :return:
+        generator of (link_id, thread) tuples, thread being a dict of comment_ids, parent_index, order,
+        depth (see assemble_thread) and texts
+    """
+    query = "SELECT link_id, comment_id, parent_id, created_utc, text FROM comments"
+
+    if link_ids is None:
+        cursor.execute(f"{query} ORDER BY link_id")
+
+        def rows():
+            while True:
+                chunk = cursor.fetchmany(fetch_size)
+                if not chunk:
+                    return
+                yield from chunk
+
+        for link_id, thread_rows in groupby(rows(), key=itemgetter(0)):
+            yield link_id, _thread_from_rows(list(thread_rows))
+        return
+
+    link_ids = sorted(set(link_ids))
+    for i in range(0, len(link_ids), batch_size):
+        batch = link_ids[i:i + batch_size]
+        cursor.execute(f"{query} WHERE link_id IN ({','.join('?' * len(batch))}) ORDER BY link_id", batch)
+
+        for link_id, thread_rows in groupby(cursor.fetchall(), key=itemgetter(0)):
+            yield link_id, _thread_from_rows(list(thread_rows))
+
+
+def submission_text(cursor, link_ids, chunk_size=900):
+    """
+    :param cursor: sqlite cursor object
+    :param link_ids: list of integer (base 36 decoded) submission ids
+
+    :return:
+        dict of link_id to (title, text) for the submissions in the database
+    """
+    reddit_ids = {f"t3_{int_to_base36(link_id)}": link_id for link_id in link_ids}
+    keys = list(reddit_ids)
+    texts = {}
+
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i:i + chunk_size]
+        cursor.execute(f"SELECT reddit_id, title, text FROM submissions WHERE reddit_id IN "
+                       f"({','.join('?' * len(chunk))})", chunk)
+        texts.update((reddit_ids[reddit_id], (title, text)) for reddit_id, title, text in cursor.fetchall())
+
+    return texts
+
+
+def stream_thread_text(cursor, out_file, link_ids=None, min_comments=1, include_submission=True, batch_size=500,
+                       separator='\n'):
+    """
+    Write the flattened text of each thread as JSON lines of {"link_id": "t3_...", "body": "..."}
+
+    :param cursor: sqlite cursor object
+    :param out_file: JSON lines file to write
+    :param link_ids: list of integer (base 36 decoded) submission ids.  default is every thread
+    :param min_comments: threads with fewer comments are skipped
+    :param include_submission: set to False to leave out the submission title and text
+    :param batch_size: threads per submissions lookup
+    :param separator: string between comments
+
+    :return:
+        number of threads written
+    """
+    written = 0
+
+    # threads are buffered a batch at a time so their submissions can be looked up in one query
+    # (on a second cursor, as the first may still be streaming comments)
+    lookup = cursor.connection.cursor()
+
+    def write_batch(threads, fout):
+        submissions = submission_text(lookup, [link_id for link_id, _ in threads]) if include_submission else {}
+        for link_id, thread in threads:
+            title, text = submissions.get(link_id, (None, None))
+            body = flatten_thread(thread['texts'], thread['order'], title, text, separator)
+            fout.write(json.dumps({'link_id': f"t3_{int_to_base36(link_id)}", 'body': body}) + '\n')
+        return len(threads)
+
+    with open(out_file, 'w', encoding='utf-8') as fout:
+        threads = []
+        for link_id, thread in iter_threads(cursor, link_ids, batch_size):
+            if len(thread['comment_ids']) < min_comments:
+                continue
+
+            threads.append((link_id, thread))
+            if len(threads) == batch_size:
+                written += write_batch(threads, fout)
+                threads = []
+
+        if threads:
+            written += write_batch(threads, fout)
+
+    return written
+
+
+def main():
+    start_time = datetime.now()
+
+    print("Enter filepath for sqlite db file: (i.e. F:/Data/my_db.db)")
+    db_file = input("DB File: ")
+    out_file = input("Output JSON lines file: ")
+    min_comments = input("Minimum comments per thread (leave blank for 1): ")
+
+    conn, cursor = get_db_connection(db_file)
+
+    written = stream_thread_text(cursor, out_file, min_comments=int(min_comments) if min_comments else 1)
+
+    print(f"{written} threads saved to {out_file}")
+    print(f"Time Elapsed: {((datetime.now() - start_time).total_seconds())/60} minutes")
+
+
+if __name__ == '__main__':
+    main()
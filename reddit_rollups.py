@@ -0,0 +1,179 @@
+"""
+Pre-aggregated rollup tables for the pushshift sqlite database
+
+Dashboards repeatedly group submissions by subreddit and day/hour, or by author and subreddit.
+These rollup tables hold the post count and total score, comments and awards for each group:
+* subreddit_daily_rollup (subreddit_id, day)
+* subreddit_hourly_rollup (subreddit_id, hour)
+* author_subreddit_rollup (author_id, subreddit_id)
+
+pushift_files_to_sqlite keeps them up to date with each committed batch, and setup_database fills them
+when they are added to an existing database.  Run this script to rebuild them from the submissions table.
+"""
+
+from collections import defaultdict
+
+from create_sqlite_db import get_db_connection, create_tables, rebuild_rollup_tables
+
+""" ROLLUP MAINTENANCE FUNCTIONS """
+
+
+def _existing_submissions(cursor, reddit_ids, chunk_size=900):
+    """
+    Fetch the currently stored copies of submissions about to be upserted
+    """
+    rows = []
+
+    for i in range(0, len(reddit_ids), chunk_size):
+        chunk = reddit_ids[i:i + chunk_size]
+        cursor.execute(f"""
+            SELECT author_id, author_flair_text, post_flair_text, created_utc, reddit_id, num_comments,
+                   nsfw, score, text, subreddit_id, title, total_awards_received
+            FROM submissions
+            WHERE reddit_id IN ({','.join('?' * len(chunk))})
+        """, chunk)
+        rows.extend(cursor.fetchall())
+
+    return rows
+
+
+def update_rollups(cursor, submissions):
+    """
+    Add a batch of submissions to the rollup tables.  Call before inserting the batch, in the same transaction
+
+    Submissions already in the database are subtracted first, so replayed or re-scored posts
+    are counted once with their latest values.  The batch is replayed the way the insert_submissions
+    upsert applies it: a post's first copy (or stored row) keeps every column but score and
+    num_comments, which come from its last copy in the batch.
+
+    :param cursor: sqlite cursor object
+    :param submissions: list of cleaned submission tuples with interned author and subreddit ids
+
+    :return:
+        None
+    """
+    daily = defaultdict(lambda: [0, 0, 0, 0])
+    hourly = defaultdict(lambda: [0, 0, 0, 0])
+    author_subreddit = defaultdict(lambda: [0, 0, 0, 0])
+
+    existing = _existing_submissions(cursor, list({post[4] for post in submissions}))
+
+    # the row each reddit_id will have once the batch is upserted
+    upserted = {post[4]: post for post in existing}
+    for post in submissions:
+        stored = upserted.get(post[4])
+        if stored is None:
+            upserted[post[4]] = post
+        else:
+            upserted[post[4]] = (*stored[:5], post[5], stored[6], post[7], *stored[8:])
+
+    # -1 backs out the stored copy of a post, +1 adds the upserted one
+    for sign, rows in ((-1, existing), (1, upserted.values())):
+        for post in rows:
+            created_utc = int(post[3])
+            totals = (sign, sign * (post[7] or 0), sign * (post[5] or 0), sign * (post[11] or 0))
+
+            for groups, key in ((daily, (post[9], created_utc - created_utc % 86400)),
+                                (hourly, (post[9], created_utc - created_utc % 3600)),
+                                (author_subreddit, (post[0], post[9]))):
+                group = groups[key]
+                for i, value in enumerate(totals):
+                    group[i] += value
+
+    for table, key_columns, groups in (('subreddit_daily_rollup', 'subreddit_id, day', daily),
+                                       ('subreddit_hourly_rollup', 'subreddit_id, hour', hourly),
+                                       ('author_subreddit_rollup', 'author_id, subreddit_id', author_subreddit)):
+        cursor.executemany(f"""
+            INSERT INTO {table} VALUES (?,?,?,?,?,?)
+            ON CONFLICT ({key_columns}) DO UPDATE SET
+                posts = posts + excluded.posts,
+                score = score + excluded.score,
+                num_comments = num_comments + excluded.num_comments,
+                total_awards_received = total_awards_received + excluded.total_awards_received
+        """, [(*key, *totals) for key, totals in groups.items()])
+
+
+def rebuild_rollups(conn):
+    """
+    Recompute every rollup table from the submissions table
+
+    :param conn: sqlite connection object
+
+    :return:
+        None
+    """
+    cursor = conn.cursor()
+    create_tables(cursor, indexes=False)
+
+    rebuild_rollup_tables(cursor)
+    conn.commit()
+
+
+""" QUERY FUNCTIONS """
+
+
+def subreddit_activity(cursor, subreddit, after=None, before=None, hourly=False):
+    """
+    Posts, score, comments and awards per day (or hour) for a subreddit
+
+    :param cursor: sqlite cursor object
+    :param subreddit: subreddit name
+    :param after: earliest utc epoch seconds to include
+    :param before: exclusive utc epoch seconds to stop at
+    :param hourly: set to True for hourly rather than daily totals
+
+    :return:
+        list of (day or hour, posts, score, num_comments, total_awards_received) tuples
+    """
+    table, period = ('subreddit_hourly_rollup', 'hour') if hourly else ('subreddit_daily_rollup', 'day')
+
+    cursor.execute(f"""
+        SELECT {period}, posts, score, num_comments, total_awards_received
+        FROM {table}
+        WHERE subreddit_id = (SELECT subreddit_id FROM subreddits WHERE subreddit = ?)
+            AND {period} >= ? AND {period} < ?
+        ORDER BY {period}
+    """, (subreddit.lower(), after or 0, before or 2 ** 62))
+
+    return cursor.fetchall()
+
+
+def top_authors(cursor, subreddit, order_by='posts', limit=25):
+    """
+    Most active authors in a subreddit
+
+    :param cursor: sqlite cursor object
+    :param subreddit: subreddit name
+    :param order_by: 'posts', 'score', 'num_comments' or 'total_awards_received'
+    :param limit: number of authors to return
+
+    :return:
+        list of (author, posts, score, num_comments, total_awards_received) tuples
+    """
+    if order_by not in ('posts', 'score', 'num_comments', 'total_awards_received'):
+        raise ValueError(f"Can't order by {order_by}")
+
+    cursor.execute(f"""
+        SELECT u.author, r.posts, r.score, r.num_comments, r.total_awards_received
+        FROM author_subreddit_rollup r
+        JOIN users u ON u.user_id = r.author_id
+        WHERE r.subreddit_id = (SELECT subreddit_id FROM subreddits WHERE subreddit = ?)
+        ORDER BY r.{order_by} DESC
+        LIMIT ?
+    """, (subreddit.lower(), limit))
+
+    return cursor.fetchall()
+
+
+def main():
+    print("Enter filepath for sqlite db file to rebuild rollups for: (i.e. F:/Data/my_db.db)")
+    db_file = input("DB File: ")
+
+    conn, cursor = get_db_connection(db_file)
+
+    rebuild_rollups(conn)
+    print("Rollups rebuilt")
+
+
+if __name__ == '__main__':
+    main()
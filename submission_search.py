@@ -0,0 +1,79 @@
+"""
+Full text search over submission titles and text
+
+Queries the submissions_fts index (an sqlite FTS5 external content table over submissions, created by
+create_sqlite_db) instead of scanning the whole table with LIKE '%...%'.  Matches are ranked with bm25,
+with title matches weighted above text matches.
+
+Queries use FTS5 syntax, i.e. 'vaccine AND mandate', '"stock market"', 'title:crypto', 'covid*'
+"""
+
+from create_sqlite_db import get_db_connection
+
+""" QUERY FUNCTIONS """
+
+
+def search_submissions(cursor, query, subreddit=None, after=None, before=None, limit=25,
+                       title_weight=2.0, text_weight=1.0):
+    """
+    Ranked full text search of submissions
+
+    :param cursor: sqlite cursor object
+    :param query: FTS5 query string
+    :param subreddit: subreddit name to limit results to.  default searches all subreddits
+    :param after: earliest utc epoch seconds to include
+    :param before: exclusive utc epoch seconds to stop at
+    :param limit: max number of results
+    :param title_weight: bm25 weight of matches in the title
+    :param text_weight: bm25 weight of matches in the text
+
+    :return:
+        list of (reddit_id, subreddit, author, created_utc, score, title, rank) tuples, best match first
+    """
+    filters = ["submissions_fts MATCH ?"]
+    params = [title_weight, text_weight, query]
+
+    if subreddit:
+        filters.append("s.subreddit_id = (SELECT subreddit_id FROM subreddits WHERE subreddit = ?)")
+        params.append(subreddit.lower())
+
+    if after:
+        filters.append("s.created_utc >= ?")
+        params.append(after)
+
+    if before:
+        filters.append("s.created_utc < ?")
+        params.append(before)
+
+    params.append(limit)
+
+    # bm25 scores are negative, lower is a better match
+    cursor.execute(f"""
+        SELECT s.reddit_id, r.subreddit, u.author, s.created_utc, s.score, s.title,
+               bm25(submissions_fts, ?, ?) AS rank
+        FROM submissions_fts
+        JOIN submissions s ON s.record_id = submissions_fts.rowid
+        LEFT JOIN subreddits r ON r.subreddit_id = s.subreddit_id
+        LEFT JOIN users u ON u.user_id = s.author_id
+        WHERE {' AND '.join(filters)}
+        ORDER BY rank
+        LIMIT ?
+    """, params)
+
+    return cursor.fetchall()
+
+
+def main():
+    db_file = input("DB File: ")
+    query = input("Search: ")
+    subreddit = input("Subreddit (leave blank to search all): ")
+
+    conn, cursor = get_db_connection(db_file)
+
+    for reddit_id, subreddit, author, created_utc, score, title, rank in search_submissions(cursor, query,
+                                                                                            subreddit=subreddit):
+        print(f"{rank:8.2f}  r/{subreddit}  {reddit_id}  u/{author}  {score}  {title}")
+
+
+if __name__ == '__main__':
+    main()
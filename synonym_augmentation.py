@@ -0,0 +1,476 @@
+"""
+Synonym augmentation for validating word embeddings
+
+Importable versions of the synonym functions from the data science notebooks:
+* synonym_token_replace (01-rjm-synonym-replacement) - replace candidate tokens with one of k invented
+  synonyms, <token>_$$<k>
+* synonym_sentence_append (02-rjm-synonym-sentence-append) - mark candidate tokens <token>_$$0 and, with
+  some probability, append a copy of the sentence using <token>_$$1
+* synonym_polyseme_replace (03-rjm-synonym-polyseme) - replace pairs of tokens with an invented
+  polyseme, <token_1>_or_<token_2>
+
+The notebook versions loop over every token in Python.  Here the corpus is encoded once as a flat int32
+array of token ids with document offsets (CSR style) plus a vocabulary list.  Candidates are chosen from
+bincount frequency counts, replacements are applied with numpy masks and all random draws for a corpus
+are made in one batch.  Invented tokens are appended to the vocabulary, so a replacement is an integer
+write rather than a new string per token.
+
+Each function takes and returns tuples of tuples of tokens like the notebook versions.  The *_ids
+variants work on the encoded corpus directly, to chain augmentations without decoding in between.
+"""
+
+import re
+
+import numpy as np
+
+""" CORPUS ENCODING FUNCTIONS """
+
+
+def encode_corpus(tokens):
+    """
+    :param tokens: a tuple of tuples of tokenized documents
+
+    :return:
+        token_ids: flat int32 array of every document's token ids
+        offsets: int64 array of document start positions in token_ids, with the total length appended
+        vocabulary: list of tokens, indexed by token id
+    """
+    index = {}
+    lengths = np.fromiter((len(doc) for doc in tokens), dtype=np.int64, count=len(tokens))
+    token_ids = np.fromiter((index.setdefault(token, len(index)) for doc in tokens for token in doc),
+                            dtype=np.int32, count=int(lengths.sum()))
+
+    offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return token_ids, offsets, list(index)
+
+
+def decode_corpus(token_ids, offsets, vocabulary):
+    """
+    :param token_ids: flat array of token ids
+    :param offsets: document start positions in token_ids, with the total length appended
+    :param vocabulary: list of tokens, indexed by token id
+
+    :return:
+        a tuple of tuples of tokenized documents
+    """
+    words = np.array(vocabulary, dtype=object)[token_ids].tolist()
+    offsets = offsets.tolist()
+
+    return tuple(tuple(words[start:end]) for start, end in zip(offsets[:-1], offsets[1:]))
+
+
+def _add_tokens(vocabulary, new_tokens):
+    """
+    Append tokens to a copy of the vocabulary
+
+    :return:
+        new vocabulary and int32 array of the new tokens' ids
+    """
+    new_ids = np.arange(len(vocabulary), len(vocabulary) + len(new_tokens), dtype=np.int32)
+    return vocabulary + list(new_tokens), new_ids
+
+
+def _token_ids(vocabulary, tokens):
+    # ids of the tokens found in the vocabulary
+    index = {token: i for i, token in enumerate(vocabulary)}
+    return [index[token] for token in tokens if token in index]
+
+
+""" CANDIDATE SELECTION FUNCTIONS """
+
+
+def candidate_token_ids(
+        token_ids,
+        offsets,
+        vocabulary,
+        ignored_tokens=None,
+        excluded_token_regex=None,
+        min_frequency=None,
+        max_frequency=None,
+        min_occurrences=None,
+        max_occurrences=None,
+        min_document_frequency=None,
+        max_document_frequency=None,
+        min_document_occurrences=None,
+        max_document_occurrences=None):
+    """
+    Ids of the tokens meeting every constraint - the vectorized equivalent of pruning the token
+    dictionary with vectorizers._vectorizers.prune_token_dictionary.  Bounds are inclusive
+
+    :param token_ids: flat array of token ids
+    :param offsets: document start positions in token_ids, with the total length appended
+    :param vocabulary: list of tokens, indexed by token id
+    :param ignored_tokens: a set of tokens to prune from token dictionary
+    :param excluded_token_regex: a regex pattern to identify tokens to prune from token dictionary
+    :param min_frequency: float - The minimum frequency of occurrence allowed for tokens
+    :param max_frequency: float - The maximum frequency of occurrence allowed for tokens
+    :param min_occurrences: int - The minimum number of occurrences allowed for tokens
+    :param max_occurrences: int - The maximum number of occurrences allowed for tokens
+    :param min_document_frequency: float - The minimum fraction of documents a token may occur in
+    :param max_document_frequency: float - The maximum fraction of documents a token may occur in
+    :param min_document_occurrences: int - The minimum number of documents a token may occur in
+    :param max_document_occurrences: int - The maximum number of documents a token may occur in
+
+    :return:
+        int32 array of candidate token ids
+    """
+    n_vocabulary = len(vocabulary)
+    n_tokens = len(token_ids)
+    n_documents = len(offsets) - 1
+
+    occurrences = np.bincount(token_ids, minlength=n_vocabulary)
+    keep = occurrences > 0
+
+    for value, bound in ((occurrences, (min_occurrences, max_occurrences)),
+                         (occurrences / max(n_tokens, 1), (min_frequency, max_frequency))):
+        if bound[0] is not None:
+            keep &= value >= bound[0]
+        if bound[1] is not None:
+            keep &= value <= bound[1]
+
+    if any(bound is not None for bound in (min_document_frequency, max_document_frequency,
+                                           min_document_occurrences, max_document_occurrences)):
+        # each token counted once per document it occurs in
+        document_index = np.repeat(np.arange(n_documents, dtype=np.int64), np.diff(offsets))
+        pairs = np.sort(document_index * n_vocabulary + token_ids)
+        first = np.ones(len(pairs), dtype=bool)
+        first[1:] = pairs[1:] != pairs[:-1]
+        documents = np.bincount(pairs[first] % n_vocabulary, minlength=n_vocabulary)
+
+        for value, bound in ((documents, (min_document_occurrences, max_document_occurrences)),
+                             (documents / max(n_documents, 1), (min_document_frequency, max_document_frequency))):
+            if bound[0] is not None:
+                keep &= value >= bound[0]
+            if bound[1] is not None:
+                keep &= value <= bound[1]
+
+    if ignored_tokens or excluded_token_regex:
+        pattern = re.compile(excluded_token_regex) if excluded_token_regex else None
+        for token_id in np.flatnonzero(keep).tolist():
+            token = vocabulary[token_id]
+            if (ignored_tokens and token in ignored_tokens) or (pattern and pattern.fullmatch(token)):
+                keep[token_id] = False
+
+    return np.flatnonzero(keep).astype(np.int32)
+
+
+def _sample_candidates(rng, token_ids, offsets, vocabulary, n_samples, prune_kwargs):
+    candidates = candidate_token_ids(token_ids, offsets, vocabulary, **prune_kwargs)
+
+    if len(candidates) < n_samples:
+        raise ValueError(f"Only {len(candidates)} tokens meet the constraints, {n_samples} needed")
+
+    return rng.choice(candidates, n_samples, replace=False)
+
+
+""" AUGMENTATION FUNCTIONS """
+
+
+def synonym_token_replace_ids(token_ids, offsets, vocabulary, candidates, replace_probability=(0.3,), rng=None):
+    """
+    Replace every occurrence of the candidate tokens with one of k synonyms, <token>_$$<k>
+
+    :param token_ids: flat array of token ids
+    :param offsets: document start positions in token_ids, with the total length appended
+    :param vocabulary: list of tokens, indexed by token id
+    :param candidates: array of token ids to replace
+    :param replace_probability: list of relative probabilities of each synonym.  normalized to sum to 1
+    :param rng: numpy Generator.  default is a new unseeded generator
+
+    :return:
+        new token_ids and the extended vocabulary.  offsets are unchanged
+    """
+    rng = rng or np.random.default_rng()
+    probabilities = np.asarray(replace_probability, dtype=np.float64)
+    probabilities = probabilities / probabilities.sum()
+    n_synonyms = len(probabilities)
+
+    # synonym k of candidate c gets id first_synonym + c * n_synonyms + k
+    vocabulary, synonym_ids = _add_tokens(vocabulary, [f"{vocabulary[candidate]}_$${k}"
+                                                       for candidate in candidates.tolist()
+                                                       for k in range(n_synonyms)])
+
+    slot = np.full(len(vocabulary), -1, dtype=np.int64)
+    slot[candidates] = np.arange(len(candidates))
+    token_slot = slot[token_ids]
+    positions = np.flatnonzero(token_slot >= 0)
+
+    token_ids = token_ids.copy()
+    draws = rng.choice(n_synonyms, size=len(positions), p=probabilities)
+    if len(synonym_ids):
+        token_ids[positions] = synonym_ids[0] + token_slot[positions] * n_synonyms + draws
+
+    return token_ids, vocabulary
+
+
+def synonym_token_replace(
+        tokens,
+        ignored_tokens=None,
+        excluded_token_regex=None,
+        min_frequency=None,
+        max_frequency=None,
+        min_occurrences=None,
+        max_occurrences=None,
+        min_document_frequency=None,
+        max_document_frequency=None,
+        min_document_occurrences=None,
+        max_document_occurrences=None,
+        num_candidates=25,
+        replace_probability=(0.3,),
+        seed=None):
+    """
+    Replace a random sample of candidate tokens with invented synonyms
+
+    Based on user-defined probabilities, candidate tokens will be replaced with one of k synonyms.
+    These synonyms will take the form <original_token>_$$<k> where k is the index of the kth probability
+    passed by the user
+
+    :param tokens: a tuple of tuples of tokenized documents
+    :param ignored_tokens ... max_document_occurrences: constraints on candidate tokens - see candidate_token_ids
+    :param num_candidates: int - The number of candidate tokens to be replaced with synonyms
+    :param replace_probability: list - List of floats of probabilities for synonym creation
+    :param seed: int - seed for the random sample and draws
+
+    :return:  a tuple of tuples of tokenized documents containing new synonym in place of original tokens
+    """
+    rng = np.random.default_rng(seed)
+    token_ids, offsets, vocabulary = encode_corpus(tokens)
+
+    candidates = _sample_candidates(rng, token_ids, offsets, vocabulary, num_candidates, dict(
+        ignored_tokens=ignored_tokens, excluded_token_regex=excluded_token_regex,
+        min_frequency=min_frequency, max_frequency=max_frequency,
+        min_occurrences=min_occurrences, max_occurrences=max_occurrences,
+        min_document_frequency=min_document_frequency, max_document_frequency=max_document_frequency,
+        min_document_occurrences=min_document_occurrences, max_document_occurrences=max_document_occurrences))
+
+    print("Candidates for replacement:")
+    print([vocabulary[candidate] for candidate in candidates.tolist()])
+
+    token_ids, vocabulary = synonym_token_replace_ids(token_ids, offsets, vocabulary, candidates,
+                                                      replace_probability, rng)
+
+    return decode_corpus(token_ids, offsets, vocabulary)
+
+
+def synonym_sentence_append_ids(token_ids, offsets, vocabulary, candidates, replace_probability=0.3, rng=None):
+    """
+    For each occurrence of a candidate token, emit a copy of its sentence with that occurrence replaced
+    by <token>_$$0 and, with probability replace_probability, a second copy using <token>_$$1.
+    Sentences without candidates are kept as they are
+
+    :param token_ids: flat array of token ids
+    :param offsets: sentence start positions in token_ids, with the total length appended
+    :param vocabulary: list of tokens, indexed by token id
+    :param candidates: array of token ids to replace
+    :param replace_probability: float - the probability a new synonym sentence will be added to the corpus
+    :param rng: numpy Generator.  default is a new unseeded generator
+
+    :return:
+        new token_ids, new offsets and the extended vocabulary
+    """
+    rng = rng or np.random.default_rng()
+
+    # <token>_$$0 and <token>_$$1 for candidate c get ids first_synonym + 2c and first_synonym + 2c + 1
+    vocabulary, synonym_ids = _add_tokens(vocabulary, [f"{vocabulary[candidate]}_$${k}"
+                                                       for candidate in candidates.tolist() for k in (0, 1)])
+
+    slot = np.full(len(vocabulary), -1, dtype=np.int64)
+    slot[candidates] = np.arange(len(candidates))
+    token_slot = slot[token_ids]
+
+    positions = np.flatnonzero(token_slot >= 0)
+    sentences = np.searchsorted(offsets, positions, side='right') - 1
+    appended = rng.random(len(positions)) <= replace_probability
+
+    first_synonym = synonym_ids[0] if len(synonym_ids) else 0
+    has_candidate = np.zeros(len(offsets) - 1, dtype=bool)
+    has_candidate[sentences] = True
+    unchanged = np.flatnonzero(~has_candidate)
+
+    # one output row per unchanged sentence, per occurrence, and per appended copy, ordered by sentence,
+    # then position, then the _$$0 copy before the _$$1 copy
+    row_sentence = np.concatenate((unchanged, sentences, sentences[appended]))
+    row_position = np.concatenate((np.full(len(unchanged), -1), positions, positions[appended]))
+    row_replacement = np.concatenate((np.full(len(unchanged), -1),
+                                      first_synonym + 2 * token_slot[positions],
+                                      first_synonym + 2 * token_slot[positions[appended]] + 1))
+    row_kind = np.concatenate((np.zeros(len(unchanged)), np.zeros(len(positions)), np.ones(appended.sum())))
+
+    order = np.lexsort((row_kind, row_position, row_sentence))
+    row_sentence, row_position, row_replacement = row_sentence[order], row_position[order], row_replacement[order]
+
+    # gather every row's tokens from its source sentence in one indexing operation
+    row_lengths = np.diff(offsets)[row_sentence]
+    new_offsets = np.zeros(len(row_sentence) + 1, dtype=np.int64)
+    np.cumsum(row_lengths, out=new_offsets[1:])
+
+    source = np.repeat(offsets[row_sentence] - new_offsets[:-1], row_lengths) + np.arange(new_offsets[-1])
+    new_token_ids = token_ids[source]
+
+    changed = row_position >= 0
+    new_token_ids[new_offsets[:-1][changed] + row_position[changed] - offsets[row_sentence[changed]]] = \
+        row_replacement[changed]
+
+    return new_token_ids, new_offsets, vocabulary
+
+
+def synonym_sentence_append(
+        corpus,
+        ignored_tokens=None,
+        excluded_token_regex=None,
+        min_frequency=None,
+        max_frequency=None,
+        min_occurrences=None,
+        max_occurrences=None,
+        min_document_frequency=None,
+        max_document_frequency=None,
+        min_document_occurrences=None,
+        max_document_occurrences=None,
+        num_candidates=25,
+        tokens_to_replace=None,
+        replace_probability=0.3,
+        seed=None):
+    """
+    Replace candidate tokens with a token indicating it is the original sentence and, based upon some
+    probability, append an identical sentence with the token replaced by one indicating it is appended
+
+    :param corpus: a tuple of tuples of tokenized sentences
+    :param ignored_tokens ... max_document_occurrences: constraints on candidate tokens - see candidate_token_ids
+    :param num_candidates: int - The number of candidate tokens to be replaced with synonyms
+    :param tokens_to_replace: list - A list of tokens to be replaced with synonyms.  If None, the other parameters
+        will be used to select tokens to replace
+    :param replace_probability: float - the probability a new synonym sentence will be added to the corpus
+    :param seed: int - seed for the random sample and draws
+
+    :return:  a tuple of tuples of tokenized sentences containing new synonym in place of original tokens and
+        a list of the words that were replaced
+    """
+    rng = np.random.default_rng(seed)
+    token_ids, offsets, vocabulary = encode_corpus(corpus)
+
+    if tokens_to_replace:
+        candidates = np.array(_token_ids(vocabulary, tokens_to_replace), dtype=np.int32)
+    else:
+        candidates = _sample_candidates(rng, token_ids, offsets, vocabulary, num_candidates, dict(
+            ignored_tokens=ignored_tokens, excluded_token_regex=excluded_token_regex,
+            min_frequency=min_frequency, max_frequency=max_frequency,
+            min_occurrences=min_occurrences, max_occurrences=max_occurrences,
+            min_document_frequency=min_document_frequency, max_document_frequency=max_document_frequency,
+            min_document_occurrences=min_document_occurrences, max_document_occurrences=max_document_occurrences))
+        tokens_to_replace = [vocabulary[candidate] for candidate in candidates.tolist()]
+
+    print("Tokens for replacement:")
+    print(tokens_to_replace)
+
+    token_ids, offsets, vocabulary = synonym_sentence_append_ids(token_ids, offsets, vocabulary, candidates,
+                                                                 replace_probability, rng)
+
+    return decode_corpus(token_ids, offsets, vocabulary), tokens_to_replace
+
+
+def synonym_polyseme_replace_ids(token_ids, offsets, vocabulary, pairs, replace_probability=(0.5, 0.3), rng=None):
+    """
+    Replace each occurrence of a paired token with the pair's polyseme, <token_1>_or_<token_2>, with the
+    probability for its place in the pair, and with <token>_$$0 otherwise
+
+    :param token_ids: flat array of token ids
+    :param offsets: document start positions in token_ids, with the total length appended
+    :param vocabulary: list of tokens, indexed by token id
+    :param pairs: (n_pairs, 2) array of token ids
+    :param replace_probability: tuple - probabilities that the first or second of the pair will be replaced
+    :param rng: numpy Generator.  default is a new unseeded generator
+
+    :return:
+        new token_ids and the extended vocabulary.  offsets are unchanged
+    """
+    rng = rng or np.random.default_rng()
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    words = pairs.ravel()
+
+    # polyseme for pair p gets id first_new + p, <token>_$$0 for paired token w gets id first_new + n_pairs + w
+    vocabulary, new_ids = _add_tokens(vocabulary,
+                                      [f"{vocabulary[first]}_or_{vocabulary[second]}" for first, second in pairs.tolist()]
+                                      + [f"{vocabulary[word]}_$$0" for word in words.tolist()])
+    first_new = new_ids[0] if len(new_ids) else 0
+
+    # later pairs win if a token is in more than one pair, as with the notebook's replacement dict
+    slot = np.full(len(vocabulary), -1, dtype=np.int64)
+    slot[words] = np.arange(len(words))
+    token_slot = slot[token_ids]
+    positions = np.flatnonzero(token_slot >= 0)
+    word_slot = token_slot[positions]
+
+    probability = np.tile(np.asarray(replace_probability, dtype=np.float64), len(pairs))
+    replaced = rng.random(len(positions)) <= probability[word_slot]
+
+    token_ids = token_ids.copy()
+    token_ids[positions] = np.where(replaced, first_new + word_slot // 2, first_new + len(pairs) + word_slot)
+
+    return token_ids, vocabulary
+
+
+def synonym_polyseme_replace(
+        tokens,
+        ignored_tokens=None,
+        excluded_token_regex=None,
+        min_frequency=None,
+        max_frequency=None,
+        min_occurrences=None,
+        max_occurrences=None,
+        min_document_frequency=None,
+        max_document_frequency=None,
+        min_document_occurrences=None,
+        max_document_occurrences=None,
+        num_pairs=25,
+        token_pairs_to_replace=None,
+        replace_probability=(0.5, 0.3),
+        seed=None):
+    """
+    Takes a tuple of tuples of tokenized documents and returns a similar tuple with certain tokens replaced with
+    manufactured polyseme.
+
+    Based on user-defined probabilities, pairs of candidate tokens will be replaced with "<token_1>_or_<token2>".
+
+    :param tokens: a tuple of tuples of tokenized documents
+    :param ignored_tokens ... max_document_occurrences: constraints on candidate tokens - see candidate_token_ids
+    :param num_pairs: int - The number of pairs of tokens to be replaced
+    :param token_pairs_to_replace: list - A list of tuples of token pairs to be replaced with synonyms.  If None,
+        the other parameters will be used to select token pairs to replace
+    :param replace_probability: tuple - Tuple of two floats of probabilities for synonym creation.   These are
+        the probability that the first or second of the token pair will be replaced, respectively.
+    :param seed: int - seed for the random sample and draws
+
+    :return:  a tuple of tuples of tokenized documents containing new synonyms in place of original tokens and
+        a dict of the words that were replaced, with their probability and polyseme
+    """
+    rng = np.random.default_rng(seed)
+    token_ids, offsets, vocabulary = encode_corpus(tokens)
+
+    if token_pairs_to_replace:
+        index = {token: i for i, token in enumerate(vocabulary)}
+        token_pairs_to_replace = [pair for pair in token_pairs_to_replace if pair[0] in index and pair[1] in index]
+        pairs = np.array([(index[first], index[second]) for first, second in token_pairs_to_replace], dtype=np.int64)
+    else:
+        candidates = _sample_candidates(rng, token_ids, offsets, vocabulary, num_pairs * 2, dict(
+            ignored_tokens=ignored_tokens, excluded_token_regex=excluded_token_regex,
+            min_frequency=min_frequency, max_frequency=max_frequency,
+            min_occurrences=min_occurrences, max_occurrences=max_occurrences,
+            min_document_frequency=min_document_frequency, max_document_frequency=max_document_frequency,
+            min_document_occurrences=min_document_occurrences, max_document_occurrences=max_document_occurrences))
+        pairs = np.stack((candidates[:num_pairs], candidates[num_pairs:]), axis=1)
+        token_pairs_to_replace = [(vocabulary[first], vocabulary[second]) for first, second in pairs.tolist()]
+
+    print("Token pairs for replacement:")
+    print(token_pairs_to_replace)
+
+    replacement_dict = {}
+    for pair in token_pairs_to_replace:
+        for idx, word in enumerate(pair):
+            replacement_dict[word] = {'prob': replace_probability[idx], 'replace': f"{pair[0]}_or_{pair[1]}"}
+
+    token_ids, vocabulary = synonym_polyseme_replace_ids(token_ids, offsets, vocabulary, pairs,
+                                                         replace_probability, rng)
+
+    return decode_corpus(token_ids, offsets, vocabulary), replacement_dict
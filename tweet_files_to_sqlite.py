@@ -0,0 +1,127 @@
+"""
+Load daily tweet files from twitter_scraper.keyword_scraper into the sqlite database
+
+keyword_scraper saves one {name}_tweets_{yyyy-mm-dd}.json file per day.  These are loaded into the
+tweets table with the same etl functions as the pushshift archives (see pushift_files_to_sqlite):
+* lines are streamed and inserted in batches with executemany
+* tweet_id is the primary key, so re-loading a file, or overlapping scrapes, update rows rather than
+  duplicating them
+* progress through each file is checkpointed in the ingestion ledger, so loaded days are skipped on
+  later runs - new days from an ongoing scrape can be added by running it again
+* only days whose scrape has finished are marked complete in the ledger (see finished_files).  Days
+  still being scraped are loaded up to their last line and resumed from there on the next run, so
+  tweets appended to them later aren't skipped
+* the tweets table is indexed on created_utc and username
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+
+from create_sqlite_db import setup_database
+from pushift_files_to_sqlite import get_db_connection, etl, parallel_etl
+from twitter_scraper import tweet_files
+
+
+def file_day(file_name):
+    # "yyyy-mm-dd" from a {name}_tweets_{yyyy-mm-dd}.json file name
+    return os.path.basename(file_name).rsplit('_', 1)[1][:-len('.json')]
+
+
+def finished_files(files, name, folder="tweets/"):
+    """
+    Daily files the scraper is done writing to
+
+    With the manifest from twitter_scraper.parallel_keyword_scraper, a day is finished once its status
+    is complete - incomplete and failed days can be retried, which appends to their files.  keyword_scraper
+    scrapes one day after another without a manifest, so every day before the latest file is finished,
+    as long as that day has ended (utc).
+
+    :param files: list of daily tweet files - see twitter_scraper.tweet_files
+    :param name: name the scrape was run with
+    :param folder: folder the scrape was saved to
+
+    :return:
+        set of the finished files
+    """
+    if folder[-1] != "/":
+        folder = folder + '/'
+
+    # the manifest written by twitter_scraper.save_manifest
+    manifest_file = f"{folder}{name}_manifest.json"
+    if os.path.exists(manifest_file):
+        with open(manifest_file, encoding='utf-8') as fin:
+            manifest = json.load(fin)
+        return {file for file in files if manifest.get(file_day(file), {}).get('status') == 'complete'}
+
+    if not files:
+        return set()
+
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    latest = max(file_day(file) for file in files)
+
+    return {file for file in files if file_day(file) < min(latest, today)}
+
+
+def load_tweet_files(conn, cursor, files, workers=None, batch_size=100000, decoder=None, sinks=None,
+                     finished=None):
+    """
+    Load daily tweet files into the tweets table
+
+    :param conn: sqlite connection object
+    :param cursor: sqlite cursor object
+    :param files: list of daily tweet files - see twitter_scraper.tweet_files
+    :param workers: number of worker processes for parallel_etl.  default loads files one at a time
+    :param batch_size: number of tweets to insert in bulk per commit
+    :param decoder: name of the line decoder to use - see pushift_files_to_sqlite.get_decoder
+    :param sinks: extra outputs fed the same cleaned batches, i.e. pushift_files_to_parquet.ParquetSink
+    :param finished: set of files the scraper is done writing to - see finished_files.  the others are
+        loaded without being marked complete in the ledger.  default treats every file as finished
+
+    :return:
+        dict of file to integer counts of tweets processed and saved to database
+    """
+    finished = set(files) if finished is None else finished
+    counts = {}
+
+    # parallel_etl marks every file complete, so files still being written are loaded one at a time
+    if workers:
+        counts.update(parallel_etl(conn, cursor, [file for file in files if file in finished], workers=workers,
+                                   batch_size=batch_size, decoder=decoder, sinks=sinks))
+        files = [file for file in files if file not in finished]
+
+    for file in files:
+        counts[file] = etl(conn, cursor, file, batch_size=batch_size, decoder=decoder, sinks=sinks,
+                           mark_complete=file in finished)
+
+    return counts
+
+
+def main():
+    start_time = datetime.now()
+
+    db_file = input("Database file: ")
+    folder = input("Tweets folder: ")
+    name = input("Scrape name: ")
+    workers = input("Worker processes (leave blank to process files one at a time): ")
+
+    conn, cursor = get_db_connection(db_file)
+
+    # creates the tweets table and its indexes in existing databases
+    setup_database(conn)
+
+    files = tweet_files(name, folder)
+    finished = finished_files(files, name, folder)
+    print(f"{len(files)} daily files found, {len(files) - len(finished)} still being scraped.")
+
+    counts = load_tweet_files(conn, cursor, files, workers=int(workers) if workers else None, finished=finished)
+
+    tweet_count = sum(post_count for post_count, _ in counts.values())
+    saved_count = sum(saved for _, saved in counts.values())
+    print(f"{tweet_count} tweets processed. {saved_count} tweets inserted into database.")
+
+    print(f"Time Elapsed: {((datetime.now() - start_time).total_seconds())/60} minutes")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,14 +9,18 @@ John Morrow
 # standard imports
 import pandas as pd
 from datetime import datetime as dt, timedelta
-import sys
 from pathlib import Path
-import subprocess
-from io import StringIO
 import os
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # external imports
 import twint
+from pandas.api.types import union_categoricals
+
+# nullable integer and categorical columns for clean_tweets
+INT_COLUMNS = ['id', 'conversation_id', 'user_id', 'replies_count', 'retweets_count', 'likes_count']
+CATEGORY_COLUMNS = ['username', 'language']
 
 
 
@@ -55,6 +59,7 @@ def keyword_scraper(name, start_date, end_date, query, output="tweets/", lang=No
     c.Search = query
 
     cnt = 0  # counter for number of failed scrapes per day
+    tracker = OutputTracker()
 
     # main loop
     os.system('clear')
@@ -92,44 +97,287 @@ def keyword_scraper(name, start_date, end_date, query, output="tweets/", lang=No
             cnt = 0
             continue
 
-        # check if the completed scrape returned the 'limit' number of tweets 
-        if limit:
-            cmd = f"wc -l {c.Output}".split(' ')
-            returned_output = subprocess.check_output(cmd)
-            ret = returned_output.decode("utf-8")
-            num_tweets = int(ret.split(' ')[0])
-
-            if num_tweets >= limit or cnt > 5:
-                start_dt = start_dt + timedelta(days=1)
-                print(f"Scrape complete. {num_tweets} collected. Commencing ", start_dt)
-                cnt = 0
-
-            else:
-                cnt += 1
-                print("Scrape incomplete.  Resuming.")
+        complete, num_tweets = check_day_output(c.Output, limit, tracker)
+
+        if complete or cnt > 5:
+            start_dt = start_dt + timedelta(days=1)
+            print(f"Scrape complete. {num_tweets} collected. Commencing ", start_dt)
+            cnt = 0
+
         else:
+            cnt += 1
+            print("Scrape incomplete.  Resuming.")
+
+    print(f"Scrape {name} completed at {dt.now()}")
+
+
+def read_last_line(file_name, block_size=4096):
+    """
+    Read the last non empty line of a file by seeking back from the end, without reading the rest
+
+    :param file_name: path to the file
+    :param block_size: bytes read per step back
+    :return: last line as bytes.  empty if the file is empty
+    """
+    with open(file_name, 'rb') as fin:
+        end = fin.seek(0, os.SEEK_END)
+        tail = b''
+
+        while end > 0:
+            start = max(0, end - block_size)
+            fin.seek(start)
+            tail = fin.read(end - start) + tail
+            end = start
+
+            # stop once the tail holds a newline before the last line's text
+            stripped = tail.rstrip(b'\r\n')
+            if b'\n' in stripped:
+                return stripped.rsplit(b'\n', 1)[1]
+
+        return tail.strip(b'\r\n')
+
+
+class OutputTracker:
+    """
+    Running line counts and earliest tweet time for scrape output files
+
+    Only the bytes written since a file was last checked are read to count lines, and the last tweet
+    is read by seeking from the end of the file, so checking a day after every retry doesn't re-read
+    the whole file or start any subprocesses.
+    """
+
+    def __init__(self):
+        # output file -> [bytes counted, lines counted, earliest "yyyy-mm-dd hh:mm:ss" seen]
+        self.files = {}
+
+    def count_lines(self, output_file, block_size=2 ** 20):
+        """
+        :param output_file: json file being scraped to
+        :param block_size: bytes read at a time
+        :return: number of lines in the file
+        """
+        state = self.files.setdefault(output_file, [0, 0, None])
+
+        with open(output_file, 'rb') as fin:
+            # a file smaller than what was counted has been rewritten.  start over
+            if fin.seek(0, os.SEEK_END) < state[0]:
+                state[:] = [0, 0, None]
+
+            fin.seek(state[0])
+            for block in iter(lambda: fin.read(block_size), b''):
+                state[0] += len(block)
+                state[1] += block.count(b'\n')
+
+        return state[1]
+
+    def earliest_tweet(self, output_file):
+        """
+        twint scrapes newest tweets first, so the last line of the file is the earliest tweet so far
+
+        :param output_file: json file being scraped to
+        :return: earliest tweet time as "yyyy-mm-dd hh:mm:ss".  None if the file is empty
+        """
+        state = self.files.setdefault(output_file, [0, 0, None])
+        line = read_last_line(output_file)
+
+        if line:
+            tweet = json.loads(line)
+            tweet_time = f"{tweet.get('date', '')} {tweet['time']}".strip()
+            if state[2] is None or tweet_time < state[2]:
+                state[2] = tweet_time
+
+        return state[2]
+
+    def check(self, output_file, limit=None):
+        """
+        Check whether a single day scrape is complete
+
+        :param output_file: json file the day was scraped to
+        :param limit: tweet limit the day was scraped with.  if set, the day is complete once the file holds
+            that many tweets.  otherwise it is complete once the earliest tweet is from the first hour of the day
+        :return: tuple of (complete, number of tweets collected)
+        """
+        num_tweets = self.count_lines(output_file)
+
+        # check if the completed scrape returned the 'limit' number of tweets
+        if limit:
+            return num_tweets >= limit, num_tweets
+
+        earliest = self.earliest_tweet(output_file)
+        return earliest is not None and earliest[-8:-6] == "00", num_tweets
+
+
+def check_day_output(output_file, limit=None, tracker=None):
+    """
+    Check whether a single day scrape is complete.  see OutputTracker.check
+
+    :param output_file: json file the day was scraped to
+    :param limit: tweet limit the day was scraped with
+    :param tracker: OutputTracker to keep counts in across checks.  default counts the file from scratch
+    :return: tuple of (complete, number of tweets collected)
+    """
+    return (tracker or OutputTracker()).check(output_file, limit)
+
+
+def day_config(name, day, query, output="tweets/", lang=None, hide=True, limit=None):
+    """
+    :param name: name for this scrape.  will be used as identifier for saved files
+    :param day: datetime of the day to scrape
+    :param query: string of keywords to search
+    :param output: folder to save output to, ending in "/"
+    :param lang: two letter language code to limit collection to that language
+    :param hide: change to False to have scraped data display to screen
+    :param limit: integer to limit scrape to that many tweets
+    :return: twint.Config for a single day search
+    """
+    c = twint.Config()
+    if hide:
+        c.Hide_output = True
+    if lang:
+        c.Lang = lang
+    if limit:
+        c.Limit = limit
+
+    c.Store_json = True
+    c.Search = query
+
+    c.Since = day.strftime('%Y-%m-%d')
+    c.Until = (day + timedelta(days=1)).strftime('%Y-%m-%d')
+    c.Output = f"{output}{name}_tweets_{c.Since}.json"
+    c.Resume = f"{output}{name}_resume_{c.Since}"
+
+    return c
+
+
+def scrape_day(name, day, query, output="tweets/", lang=None, hide=True, limit=None, max_retries=5,
+               search=twint.run.Search):
+    """
+    Scrape one day with its own twint.Config, retrying until the day is complete or retries run out.
+    Runs in a worker process of parallel_keyword_scraper
+
+    :param name: name for this scrape.  will be used as identifier for saved files
+    :param day: datetime of the day to scrape
+    :param query: string of keywords to search
+    :param output: folder to save output to, ending in "/"
+    :param lang: two letter language code to limit collection to that language
+    :param hide: change to False to have scraped data display to screen
+    :param limit: integer to limit scrape to that many tweets
+    :param max_retries: number of retries after an error or an incomplete scrape
+    :param search: function run with the config to scrape it.  default is twint.run.Search
+    :return: dict with the day's status ('complete', 'incomplete' or 'failed'), tweets and retries
+    """
+    c = day_config(name, day, query, output, lang, hide, limit)
+    tracker = OutputTracker()
+    retries = 0
+    error = None
+
+    while True:
+        try:
+            search(c)
+            error = None
+
+            # no file means no tweets were found for the day
+            if not Path(c.Output).is_file():
+                return {'status': 'complete', 'tweets': 0, 'retries': retries}
+
+            complete, num_tweets = check_day_output(c.Output, limit, tracker)
+            if complete:
+                return {'status': 'complete', 'tweets': num_tweets, 'retries': retries}
+
+        except Exception as e:
+            error = e
+            print(f"{c.Since} error: {e}")
+
+        if retries >= max_retries:
+            break
+        retries += 1
+
+    if error:
+        return {'status': 'failed', 'tweets': 0, 'retries': retries, 'error': str(error)}
+
+    return {'status': 'incomplete', 'tweets': num_tweets, 'retries': retries}
+
+
+def load_manifest(manifest_file):
+    """
+    :param manifest_file: path to json manifest of days scraped
+    :return: dict of day ("yyyy-mm-dd") to status dict.  empty if there is no manifest yet
+    """
+    if not Path(manifest_file).is_file():
+        return {}
+
+    with open(manifest_file, 'r', encoding='utf-8') as fin:
+        return json.load(fin)
+
+
+def save_manifest(manifest, manifest_file):
+    # write to a temp file and swap it in, so a crash mid write can't corrupt the manifest
+    temp_file = manifest_file + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as fout:
+        json.dump(manifest, fout, indent=1, sort_keys=True)
+    os.replace(temp_file, manifest_file)
+
+
+def parallel_keyword_scraper(name, start_date, end_date, query, output="tweets/", lang=None, hide=True, limit=None,
+                             workers=4, max_retries=5, retry_incomplete=False, search=twint.run.Search):
+    """
+    keyword_scraper with days scraped concurrently in a pool of worker processes
+
+    Each day's status, tweet count and retries are recorded in {output}{name}_manifest.json as days
+    finish.  Rerunning the same scrape skips days already complete, so it picks up where it stopped.
+
+    :param name: name for this scrape.  will be used as identifier for saved files
+    :param start_date: earliest date to scrape.  string in format "yyyy-mm-dd"
+    :param end_date:  exclusive date to stop scrape. string in format "yyyy-mm-dd"
+    :param query: string of keywords to search.  separate terms with OR as spaces == AND
+    :param output: folder to save output to.  default is "tweets/"
+    :param lang: two letter language code to limit collection to that language.  default collects all tweets
+    :param hide: change to False to have scraped data display to screen
+    :param limit: pass in integer to limit scrape to that many tweets per day.  default is all tweets
+    :param workers: number of days scraped at once
+    :param max_retries: retries per day after an error or an incomplete scrape
+    :param retry_incomplete: set to True to rescrape days that were still incomplete after max_retries
+    :param search: function run with each day's twint.Config.  must be picklable.  default is twint.run.Search
+    :return: manifest dict of day to status
+    """
+    start_dt = dt.strptime(start_date, "%Y-%m-%d")
+    end_dt = dt.strptime(end_date, "%Y-%m-%d")
+    if output[-1] != "/":
+        output = output + '/'
 
-            cmd = ['tail', '-n', '1', f'{c.Output}']
+    Path(output).mkdir(parents=True, exist_ok=True)
 
-            a = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            b = StringIO(a.communicate()[0].decode('utf-8'))
+    manifest_file = f"{output}{name}_manifest.json"
+    manifest = load_manifest(manifest_file)
 
-            
+    done = {'complete', 'incomplete'} if not retry_incomplete else {'complete'}
+    days = [start_dt + timedelta(days=i) for i in range((end_dt - start_dt).days)]
+    days = [day for day in days if manifest.get(day.strftime('%Y-%m-%d'), {}).get('status') not in done]
 
-            print("Checking last tweet time...")
+    print(f"Scrape {name} begun at {dt.now()}. {len(days)} days to scrape.")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(scrape_day, name, day, query, output, lang, hide, limit, max_retries, search):
+                   day.strftime('%Y-%m-%d') for day in days}
+
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'status': 'failed', 'tweets': 0, 'retries': 0, 'error': str(e)}
 
-            df = pd.read_json(b, lines=True)
-            if (df.iloc[0].time[:2] == "00") or (cnt > 5):
-                start_dt = start_dt + timedelta(days=1)
-                print("Scrape complete. End of day reached. Commencing ", start_dt)
-                cnt=0
+            # retries add up across runs
+            result['retries'] += manifest.get(day, {}).get('retries', 0)
+            manifest[day] = result
+            save_manifest(manifest, manifest_file)
 
-            else:
-                cnt += 1
-                print("Scrape incomplete.  Resuming.")
+            print(f"{day} {result['status']}. {result['tweets']} tweets collected.")
 
     print(f"Scrape {name} completed at {dt.now()}")
 
+    return manifest
+
 
 def user_tweets_scraper(user_id,start_date, end_date=None,hide=True, limit=None):
     """
@@ -165,17 +413,87 @@ def user_profile_scraper():
 
 def clean_tweets(df):
     """
-    :param df: dataframe of tweets
+    :param df: dataframe of tweets, from twint's Pandas output or its json files
     :return: cleaned dataframe for analysis
     """
     cols_to_drop = ["retweet_date", "retweet","translate", "trans_src", "trans_dest", "retweet_id", "user_rt",
                         "user_rt_id", "source", "geo", "near", "search", "user_id_str", "day", "hour", "timezone",
                     "date", "time"]
-    df.drop(columns=cols_to_drop, inplace=True, errors='ignore')
-        
-    df.replace({'':None}, inplace=True)
-    df['video'] = df.video.astype('bool')
+    df = df.drop(columns=cols_to_drop, errors='ignore')
+
+    # empty strings only occur in string columns.  replacing them frame wide made every column object
+    for col in df.columns:
+        if df[col].dtype == 'object' or pd.api.types.is_string_dtype(df[col].dtype):
+            df[col] = df[col].where(df[col].notna() & df[col].ne(''), None)
+
+    if 'video' in df.columns:
+        df['video'] = df['video'].eq(1).astype('boolean').mask(df['video'].isna())
+
+    # twint stores created_at as epoch milliseconds.  fall back to parsing strings from other sources
+    if 'created_at' in df.columns:
+        if pd.api.types.is_numeric_dtype(df['created_at']):
+            df['created_at'] = pd.to_datetime(df['created_at'], unit='ms')
+        else:
+            df['created_at'] = pd.to_datetime(df['created_at'], utc=True, errors='coerce').dt.tz_localize(None)
+
+    for col in INT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    df = df.rename(columns={'created_at':'created_at_utc'})
+
+    return df
+
+
+def tweet_files(name, output="tweets/"):
+    """
+    :param name: name the scrape was run with
+    :param output: folder the scrape was saved to
+    :return: sorted list of the scrape's daily json files
+    """
+    return sorted(str(path) for path in Path(output).glob(f"{name}_tweets_*.json"))
+
+
+def iter_clean_tweets(files, chunksize=100000):
+    """
+    Read and clean tweets from json lines files a chunk at a time
+
+    :param files: list of json lines files, i.e. from tweet_files
+    :param chunksize: number of tweets read at a time
+    :return: generator of cleaned dataframes
+    """
+    for file_name in files:
+        # dtype=False keeps ids and numeric looking strings as read, clean_tweets sets the dtypes
+        with pd.read_json(file_name, lines=True, chunksize=chunksize, dtype=False) as reader:
+            for df in reader:
+                yield clean_tweets(df)
+
+
+def load_clean_tweets(files, chunksize=100000):
+    """
+    Clean tweets from json lines files a chunk at a time and combine them, so only one raw chunk is
+    held in memory at once
+
+    :param files: list of json lines files, i.e. from tweet_files
+    :param chunksize: number of tweets read at a time
+    :return: cleaned dataframe of all the tweets
+    """
+    chunks = list(iter_clean_tweets(files, chunksize))
+    if not chunks:
+        return pd.DataFrame()
+
+    # concat falls back to object for categoricals with different categories, so merge the categories first
+    categories = {}
+    for col in CATEGORY_COLUMNS:
+        if all(col in chunk.columns for chunk in chunks):
+            categories[col] = union_categoricals([chunk[col] for chunk in chunks]).categories
 
-    df.rename(columns={'created_at':'created_at_utc'})
+    for chunk in chunks:
+        for col, cats in categories.items():
+            chunk[col] = chunk[col].cat.set_categories(cats)
 
-    return df
\ No newline at end of file
+    return pd.concat(chunks, ignore_index=True)
@@ -1,23 +1,31 @@
 import pandas as pd
+import numpy as np
 from psaw import PushshiftAPI
 import pickle
 import codecs
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from pushshift_fetcher import RateLimiter
 
 
 api = PushshiftAPI()
 
+FREQ_FILE = "/nfs/scraped_data/clean_data/reddit_posts/users_agg_freq.json"
+CHECKPOINT_FILE = "/nfs/scraped_data/clean_data/reddit_posts/users_agg_freq_done.txt"
+
 def reddit_author_timeofday_distribution(author, api=api, after=1577836800):
     # Search comments
     gen1 = api.search_comments(author=author, select=['created_utc'], aggs='created_utc',after=after, frequency='hour',limit=0, metadata=False)
     data = list(gen1)[0]['created_utc']
-    
+
     # Search submissions
     gen2 = api.search_submissions(author=author, select=['created_utc'], aggs='created_utc',after=after, frequency='hour',limit=0, metadata=False)
     data2 = list(gen2)[0]['created_utc']
     # Append submissions data to comments data
     data.extend(data2)
     df = pd.DataFrame(data)
-    
+
     # If there's data, parse the dates, aggregate and return
     if df.shape[0]>0:
         df['datetime'] = pd.to_datetime(df['key'],unit='s')
@@ -26,42 +34,138 @@ def reddit_author_timeofday_distribution(author, api=api, after=1577836800):
         ret = hour_counts['doc_count'].reset_index()
         ret['author'] = author
         return ret.pivot(index='author',columns='hour',values='doc_count')
-    
+
     # If no data, return None
     else:
         return None
 
-def save_freq(temp_df):
-    with codecs.open("/nfs/scraped_data/clean_data/reddit_posts/users_agg_freq.json", 'a', encoding='utf-8') as fout:
+def author_hour_counts(author, api=api, after=1577836800, rate_limiter=None):
+    """
+    Comment + submission counts by utc hour of day for one author
+
+    Same pushshift aggregation queries as reddit_author_timeofday_distribution, but the buckets
+    are summed straight into an array rather than through a dataframe.
+
+    :param author: reddit username
+    :param api: PushshiftAPI object
+    :param after: utc epoch seconds to count posts from
+    :param rate_limiter: optional pushshift_fetcher.RateLimiter, waited on before each request
+
+    :return:
+        int64 array of 24 counts, index is the hour
+    """
+    counts = np.zeros(24, dtype=np.int64)
+
+    for search in (api.search_comments, api.search_submissions):
+        if rate_limiter:
+            rate_limiter.wait()
+        gen = search(author=author, select=['created_utc'], aggs='created_utc', after=after, frequency='hour', limit=0, metadata=False)
+        buckets = list(gen)[0]['created_utc']
+
+        if buckets:
+            keys = np.fromiter((bucket['key'] for bucket in buckets), dtype=np.int64, count=len(buckets))
+            doc_counts = np.fromiter((bucket['doc_count'] for bucket in buckets), dtype=np.int64, count=len(buckets))
+            counts += np.bincount(keys // 3600 % 24, weights=doc_counts, minlength=24).astype(np.int64)
+
+    return counts
+
+def counts_to_df(authors, counts):
+    """
+    Wide author x hour dataframe in the same layout save_freq wrote from reddit_author_timeofday_distribution
+
+    :param authors: list of authors, one per row of counts
+    :param counts: (len(authors), 24) array of counts
+
+    :return:
+        dataframe with an author column and one column per hour 0 - 23
+    """
+    df = pd.DataFrame(counts, columns=list(range(24)))
+    df.insert(0, 'author', authors)
+    return df
+
+def save_freq(temp_df, freq_file=FREQ_FILE):
+    with codecs.open(freq_file, 'a', encoding='utf-8') as fout:
         temp_df.to_json(fout, orient='records', lines=True)
         fout.write('\n')
 
+def load_checkpoint(checkpoint_file=CHECKPOINT_FILE):
+    """
+    :param checkpoint_file: text file of completed authors, one per line
+
+    :return:
+        set of completed authors
+    """
+    if not os.path.exists(checkpoint_file):
+        return set()
+
+    with open(checkpoint_file, 'r', encoding='utf-8') as fin:
+        return set(line.strip() for line in fin if line.strip())
+
+def save_checkpoint(authors, checkpoint_file=CHECKPOINT_FILE):
+    with open(checkpoint_file, 'a', encoding='utf-8') as fout:
+        fout.writelines(author + '\n' for author in authors)
+
+def aggregate_authors(authors, max_workers=8, requests_per_second=1.0, chunk_size=1000, freq_file=FREQ_FILE,
+                      checkpoint_file=CHECKPOINT_FILE, get_counts=author_hour_counts):
+    """
+    Time of day distributions for many authors, fetched concurrently and saved in chunks
+
+    Authors in the checkpoint file are skipped.  Each chunk's counts are filled into a preallocated
+    (chunk x 24) array as requests finish; authors with posts are appended to freq_file, then every
+    author that finished is appended to the checkpoint file, so a rerun picks up where the last one
+    stopped.  Authors whose requests failed aren't checkpointed and are retried next run.
+
+    :param authors: list of reddit usernames
+    :param max_workers: number of authors fetched at once
+    :param requests_per_second: global pushshift request rate across all workers
+    :param chunk_size: authors per saved chunk
+    :param freq_file: JSON lines file the distributions are appended to
+    :param checkpoint_file: text file of completed authors
+    :param get_counts: function(author, rate_limiter=...) -> array of 24 counts.  default queries pushshift
+
+    :return:
+        number of authors completed
+    """
+    done = load_checkpoint(checkpoint_file)
+    todo = [author for author in dict.fromkeys(author.lower() for author in authors) if author not in done]
+    print(f"{len(done)} authors already done, {len(todo)} to go.")
+
+    rate_limiter = RateLimiter(requests_per_second)
+    completed = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(todo), chunk_size):
+            chunk = todo[start:start + chunk_size]
+            counts = np.zeros((len(chunk), 24), dtype=np.int64)
+            finished = np.zeros(len(chunk), dtype=bool)
+
+            futures = {executor.submit(get_counts, author, rate_limiter=rate_limiter): i for i, author in enumerate(chunk)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    counts[i] = future.result()
+                    finished[i] = True
+                except Exception as e:
+                    print(chunk[i], e)
+
+            has_posts = finished & (counts.sum(axis=1) > 0)
+            if has_posts.any():
+                save_freq(counts_to_df([chunk[i] for i in np.flatnonzero(has_posts)], counts[has_posts]), freq_file)
+            save_checkpoint([chunk[i] for i in np.flatnonzero(finished)], checkpoint_file)
+
+            completed += int(finished.sum())
+            print(f"Authors {start} to {start + len(chunk)} saved. {completed} completed.")
+
+    return completed
+
 
 def main():
     with open("/nfs/scraped_data/clean_data/reddit_posts/reddit_users_list.pkl", "rb") as fin:
         authors = pickle.load(fin)
 
-    start_chunk = 0
-    end_chunk = 10
-
-    while start_chunk < len(authors):
-        temp_df=pd.DataFrame()
-        print(f"Getting authors {start_chunk} to {end_chunk}.")
-        for author in authors[start_chunk:end_chunk]:    
-            try:
-                author = author.lower()
-                freq = reddit_author_timeofday_distribution(author)
-                temp_df = pd.concat([temp_df, freq])
-            except KeyError as e:
-                print(author, e)
-
-        temp_df.reset_index(inplace=True)
-        save_freq(temp_df)
-        print("Last author saved:", end_chunk)
-        start_chunk = end_chunk
-        end_chunk += 10
+    aggregate_authors(authors, max_workers=8, requests_per_second=1.0, chunk_size=1000)
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()